@@ -1,97 +1,325 @@
+import collections
+import functools
 import random
 import re
+import threading
 import time
+import typing
+from concurrent.futures import Future
+
 import serial
+from machine.exceptions import GRBLError
+from machine.status import MachineStatus, parse_status
 from tools.uart import serial_ports
-from decimal import *
-getcontext().prec = 3
 
 BAUD_RATE = 115200
+READ_TIMEOUT = 0.1
+# serial receive buffer of the controller, see grbl/config.h RX_BUFFER_SIZE
+RX_BUFFER_SIZE = 127
+COMMENT_REGEX = re.compile(r'\(.*?\)|;.*')
 
 
 class GRBL:
-    STATUS_REGEX = r"""<(?P<State>Idle|Run|Hold|Home|Alarm|Check|Door|Jog)(?:,MPos:(?P<MX>-?[0-9\.]*),(?P<MY>-?[0-9\.]*),(?P<MZ>-?[0-9\.]*))?(?:,WPos:(?P<WX>-?[0-9\.]*),(?P<WY>-?[0-9\.]*),(?P<WZ>-?[0-9\.]*))?(?:,Buf:(?P<Buf>[0-9]*))?(?:,RX:(?P<RX>[0-9]*))?(?:,Ln:(?P<L>[0-9]*))?(?:,F:(?P<F>-?[0-9\.]*))?(?:,Lim:(?P<Lim>[0-1]*))?(?:,Ctl:(?P<Ctl>[0-1]*))?(?:,FS:(?P<FS1>[0-9]*),(?P<FS2>[0-9]*))?(?:,Ov:(?P<OvFeed>-?[0-9\.]*),(?P<OvRapid>-?[0-9\.]*),(?P<OvSpindle>-?[0-9\.]*))?(?:,WCO:(?P<WCX>-?[0-9\.]*),(?P<WCY>-?[0-9\.]*),(?P<WCZ>-?[0-9\.]*))?>"""
-
     def __init__(self, port: str = None):
         assert port
         self.port = port
-        self.conn = serial.Serial(port, BAUD_RATE)
-        self.status_matcher = re.compile(self.STATUS_REGEX)
-        self.state = None
-        self._wait_ok = False
-        self._ok = False
-        self.machine_position = 0, 0, 0
-        self.work_position = 0, 0, 0
+        self.conn = serial.Serial(port, BAUD_RATE, timeout=READ_TIMEOUT)
+        # latest MachineStatus, replaced as a whole by the reader thread so
+        # other threads can read it without locking
+        self.status = MachineStatus(None)
+        self.status.machine_position = 0, 0, 0
+        self.status.work_position = 0, 0, 0
+        self._status_cond = threading.Condition()
+        self._poll_interval = None
+        self._poller = None
+        self._status_requested_at = None
+        # set by the reader thread when the start-up banner arrives
+        self.banner = None
+        self._banner_seen = threading.Event()
+        # (command, future, length, sent_at) for every line sent and not yet
+        # answered, GRBL answers lines strictly in order, so the lengths add
+        # up to what still sits in its receive buffer
+        self._pending = collections.deque()
+        self._rx_used = 0
+        self._write_lock = threading.Lock()
+        self._rx_space = threading.Condition(self._write_lock)
+        self._listeners = []
+        self._running = True
+        self._reader = threading.Thread(
+            target=self.read_machine, name=f'GRBL {port}', daemon=True
+        )
+        self._reader.start()
 
     def __del__(self):
+        self.close()
+
+    def close(self):
+        self._running = False
+        self.stop_status_polling()
+        with self._rx_space:
+            self._rx_space.notify_all()
         try:
             self.conn.close()
         except:
             pass
 
-    @staticmethod
-    def _xyz_to_decimal(xyz):
-        return Decimal(xyz[0]), Decimal(xyz[1]), Decimal(xyz[2])
+    def subscribe(self, callback):
+        """
+        callback(event, payload) is called from the reader thread for every
+        line: ('status', MachineStatus), ('ok', command),
+        ('error', GRBLError), ('message', line), followed by
+        ('roundtrip', (command, seconds)) for acknowledged lines and
+        answered '?' requests
+        """
+        self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _emit(self, event, payload):
+        for callback in self._listeners:
+            callback(event, payload)
+
+    @property
+    def state(self):
+        return self.status.state
+
+    @property
+    def machine_position(self):
+        return self.status.machine_position
+
+    @property
+    def work_position(self):
+        return self.status.work_position
+
+    def _update_status(self, status: MachineStatus):
+        previous = self.status
+        # keep the last known positions when a report can't provide them,
+        # e.g. 1.1 WPos before the first WCO
+        if status.machine_position is None:
+            status.machine_position = previous.machine_position
+        if status.work_position is None:
+            status.work_position = previous.work_position
+        status.received_at = time.monotonic()
+        with self._status_cond:
+            self.status = status
+            self._status_cond.notify_all()
+
+    def _resolve(self, error=None, answered=True):
+        with self._rx_space:
+            if not self._pending:
+                return
+            command, future, length, sent_at = self._pending.popleft()
+            self._rx_used -= length
+            self._rx_space.notify_all()
+        if error is None:
+            future.set_result(command)
+            self._emit('ok', command)
+        else:
+            error.command = command
+            future.set_exception(error)
+            self._emit('error', error)
+        if answered:
+            # lines failed by a reset or disconnect were never answered
+            self._emit('roundtrip', (command, time.monotonic() - sent_at))
+
+    def _fail_pending(self, reason):
+        while self._pending:
+            self._resolve(GRBLError(reason), answered=False)
+
+    def _handle_line(self, grbl_response):
+        status = parse_status(grbl_response, self.status)
+        if status is not None:
+            self._update_status(status)
+            self._emit('status', status)
+            requested_at, self._status_requested_at = self._status_requested_at, None
+            if requested_at is not None:
+                self._emit('roundtrip', ('?', status.received_at - requested_at))
+        elif grbl_response == 'ok':
+            self._resolve()
+        elif grbl_response.startswith('error:'):
+            self._resolve(GRBLError(grbl_response[len('error:'):]))
+        else:
+            if grbl_response.startswith('Grbl '):
+                # banner after a reset, queued lines are gone
+                self._fail_pending('reset')
+                self.banner = grbl_response
+                # a '?' sent while the board was booting is never answered
+                self._status_requested_at = None
+                self._banner_seen.set()
+            print(grbl_response)
+            self._emit('message', grbl_response)
 
     def read_machine(self):
-        while self.conn.in_waiting != 0:
-            grbl_response = self.conn.readline().strip().decode('utf-8')
-            result = self.status_matcher.match(grbl_response.replace('|', ','))
-            if result:
-                self.state = result.group('State')
-                received_machine_position = result.group('MX'), result.group('MY'), result.group('MZ')
-                received_work_position = result.group('WX'), result.group('WY'), result.group('WZ')
-                received_offset_position = result.group('WCX'), result.group('WCY'), result.group('WCZ')
-
-                if received_machine_position[0]:
-                    self.machine_position = self._xyz_to_decimal(received_machine_position)
-                    if received_offset_position[0]:
-                        # WPos = MPos - WCO
-                        offset_x, offset_y, offset_z = self._xyz_to_decimal(received_offset_position)
-                        self.work_position = \
-                            self.machine_position[0] - offset_x, \
-                            self.machine_position[1] - offset_y,\
-                            self.machine_position[2] - offset_z
-
-                if received_work_position[0]:
-                    if received_offset_position[0]:
-                        self.work_position = self._xyz_to_decimal(received_work_position)
-                        # MPos = WPos + WCO
-                        offset_x, offset_y, offset_z = self._xyz_to_decimal(received_offset_position)
-                        self.machine_position = \
-                            self.work_position[0] + offset_x, \
-                            self.work_position[1] + offset_y, \
-                            self.work_position[2] + offset_z,
-
-            elif grbl_response == 'ok':
-                self._ok = True
-            else:
-                print(grbl_response)
-
-    def send_command(self, command: str, wait_ok=True):
-        self.conn.flushInput()
+        """
+        Reader thread: turns every line from the machine into an event
+        """
+        partial = b''
+        while self._running:
+            try:
+                line = self.conn.readline()
+            except (OSError, serial.SerialException, TypeError):
+                # port closed under us
+                break
+            if not line.endswith(b'\n'):
+                partial += line
+                continue
+            grbl_response = (partial + line).strip().decode('utf-8', 'replace')
+            partial = b''
+            if grbl_response:
+                self._handle_line(grbl_response)
+        self._fail_pending('disconnected')
+
+    def _write_line(self, command: str) -> Future:
+        """
+        Character-counting send: blocks only while the line would overflow
+        the controller's receive buffer
+        """
+        data = str.encode(command + '\n')
+        if len(data) > RX_BUFFER_SIZE:
+            raise ValueError(f'line longer than {RX_BUFFER_SIZE} bytes: {command}')
+        future = Future()
+        with self._rx_space:
+            self._rx_space.wait_for(
+                lambda: self._rx_used + len(data) <= RX_BUFFER_SIZE
+                or not self._running
+            )
+            if not self._running:
+                raise GRBLError('disconnected', command)
+            self._pending.append((command, future, len(data), time.monotonic()))
+            self._rx_used += len(data)
+            self.conn.write(data)
+        return future
+
+    def send_command(self, command: str, wait_ok=True) -> Future:
+        """
+        Returns a future resolved by the machine's ok for this line, or
+        failed with GRBLError on error. wait_ok blocks until then.
+        """
         print(command)
-        self.conn.write(str.encode(command + '\n'))
-        self._ok = False
-        while wait_ok and not self._ok:
-            self.read_machine()
-
-    def update_status(self):
-        self.send_command('?', True)
-        self.read_machine()
+        future = self._write_line(command)
+        if wait_ok:
+            future.result()
+        return future
+
+    def stream(
+        self,
+        lines: typing.Iterable[str],
+        on_ack: typing.Callable[[int, Future], None] = None,
+    ) -> typing.List[Future]:
+        """
+        Streams a G-code program keeping GRBL's receive buffer full instead
+        of waiting for every ok (the character-counting protocol of
+        grbl's stream.py). Comments and blank lines are dropped.
+        on_ack(line_number, future) runs on the reader thread as each line
+        is acknowledged; future.exception() is the GRBLError, if any.
+        Returns the futures of the lines sent, in order.
+        """
+        futures = []
+        for line_number, line in enumerate(lines, 1):
+            command = COMMENT_REGEX.sub('', line).strip()
+            if not command:
+                continue
+            future = self._write_line(command)
+            if on_ack:
+                future.add_done_callback(functools.partial(on_ack, line_number))
+            futures.append(future)
+        return futures
+
+    def request_status(self):
+        # realtime command: no newline, no ok, not counted in the RX buffer
+        with self._write_lock:
+            # stamped first, the answer can beat the return of write()
+            if self._status_requested_at is None:
+                self._status_requested_at = time.monotonic()
+            self.conn.write(b'?')
+
+    def cycle_start(self):
+        """Realtime cycle start: resumes a feed hold or an M0 pause"""
+        with self._write_lock:
+            self.conn.write(b'~')
+
+    def update_status(self, timeout=1.0) -> MachineStatus:
+        previous = self.status
+        self.request_status()
+        with self._status_cond:
+            self._status_cond.wait_for(lambda: self.status is not previous, timeout)
         print('S', self.state, ' | M:', self.machine_position[0], self.machine_position[1], ' | W:', self.work_position[0], self.work_position[1])
+        return self.status
+
+    def _poll_status(self):
+        while self._running and self._poll_interval:
+            try:
+                self.request_status()
+            except (OSError, serial.SerialException):
+                return
+            time.sleep(self._poll_interval)
 
-    def wake_up(self):
-        self.send_command("\r\n\r\n", wait_ok=False)
-        time.sleep(3)
-        self.conn.flushInput()
+    def start_status_polling(self, interval=0.1):
+        """
+        Sends '?' every interval seconds from a background thread, self.status
+        then always holds a recent snapshot
+        """
+        self._poll_interval = interval
+        if self._poller is None or not self._poller.is_alive():
+            self._poller = threading.Thread(
+                target=self._poll_status, name=f'GRBL {self.port} status', daemon=True
+            )
+            self._poller.start()
+
+    def stop_status_polling(self):
+        self._poll_interval = None
+
+    def wait_for_idle(self, timeout=30.0) -> MachineStatus:
+        """
+        Blocks until all queued motion has finished and a status report
+        taken afterwards says Idle. G4 P0 is only acknowledged once the
+        planner buffer is empty.
+        """
+        self.send_command('G4P0')
+        done = time.monotonic()
+        deadline = done + timeout
+
+        def settled():
+            status = self.status
+            return status.received_at is not None and status.received_at > done \
+                and status.state == 'Idle'
+
+        while not settled():
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'machine not idle: {self.status}')
+            if not self._poll_interval:
+                self.request_status()
+            with self._status_cond:
+                self._status_cond.wait_for(settled, 0.1)
+        return self.status
+
+    def wake_up(self, timeout=5.0) -> bool:
+        """
+        Returns once GRBL is ready: when its start-up banner arrives (opening
+        the port resets most boards) or, for boards that keep running, when
+        it answers a status request. False if neither happens in timeout.
+        """
+        previous = self.status
+        with self._write_lock:
+            self.conn.write(b"\r\n\r\n")
+        deadline = time.monotonic() + timeout
+        ready = False
+        while time.monotonic() < deadline:
+            if self._banner_seen.wait(0.1) or self.status is not previous:
+                ready = True
+                break
+            self.request_status()
+        self._fail_pending('wake up')
+        return ready
 
     def set_zero(self):
         self.send_command('G10 P0 L20 X0 Y0 Z0')
 
-    def go_to(self, x, y, f=1000):
+    def go_to(self, x, y, f=1000, wait_ok=True):
         command = f'G0X{x}Y{y}F{f}'
-        self.send_command(command)
+        return self.send_command(command, wait_ok)
 
     def home(self):
         self.send_command('$H')
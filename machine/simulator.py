@@ -0,0 +1,175 @@
+import os
+import re
+import threading
+import time
+import tty
+
+from machine.grbl import RX_BUFFER_SIZE
+
+WORD_REGEX = re.compile(r'([A-Z])(-?[0-9]*\.?[0-9]+)')
+SUPPORTED_WORDS = set('GMXYZFSPLTN')
+
+
+class GRBLSimulator:
+    """
+    Stand-in GRBL controller on a pseudo terminal, for testing the serial
+    protocol without hardware (POSIX only).
+
+    Models the 127-byte receive buffer (overflowing bytes are lost and
+    counted, like on the real controller), answers every line with ok or
+    error:N after line_time seconds of simulated planning, answers the
+    realtime '?' with a 1.1 status report and prints the banner on ctrl-x.
+    M0 holds the following lines until the realtime cycle start '~'.
+
+        sim = GRBLSimulator().start()
+        machine = GRBL(sim.port)
+    """
+
+    def __init__(self, line_time: float = 0.002, version: str = '1.1h'):
+        self.line_time = line_time
+        self.version = version
+        self.state = 'Idle'
+        self.position = [0.0, 0.0, 0.0]
+        self.absolute = True
+        self.lines = []
+        self.rx_peak = 0
+        self.overflows = 0
+        self._rx = bytearray()
+        self._rx_cond = threading.Condition()
+        self._resume = threading.Event()
+        self._write_lock = threading.Lock()
+        self._running = False
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+    def start(self):
+        self._running = True
+        for target in (self._receive, self._execute):
+            threading.Thread(target=target, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._resume.set()
+        with self._rx_cond:
+            self._rx_cond.notify_all()
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _send(self, text: str):
+        with self._write_lock:
+            os.write(self._master, (text + '\r\n').encode())
+
+    def status_report(self) -> str:
+        x, y, z = self.position
+        return f'<{self.state}|MPos:{x:.3f},{y:.3f},{z:.3f}|FS:0,0|WCO:0.000,0.000,0.000>'
+
+    def _receive(self):
+        while self._running:
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                return
+            for byte in data:
+                if byte == ord('?'):
+                    self._send(self.status_report())
+                elif byte == 0x18:
+                    with self._rx_cond:
+                        self._rx.clear()
+                    self._send(f"Grbl {self.version} ['$' for help]")
+                elif byte == ord('~'):
+                    with self._rx_cond:
+                        if self.state.startswith('Hold'):
+                            self.state = 'Idle'
+                            self._resume.set()
+                elif byte == ord('!'):
+                    continue
+                else:
+                    with self._rx_cond:
+                        if len(self._rx) >= RX_BUFFER_SIZE:
+                            self.overflows += 1
+                            continue
+                        self._rx.append(byte)
+                        self.rx_peak = max(self.rx_peak, len(self._rx))
+                        self._rx_cond.notify()
+
+    def _next_line(self):
+        with self._rx_cond:
+            self._rx_cond.wait_for(lambda: b'\n' in self._rx or not self._running)
+            if not self._running:
+                return None
+            end = self._rx.index(b'\n') + 1
+            line = bytes(self._rx[:end])
+            # the buffer frees up only once the line has been planned
+            return line, end
+
+    def _execute(self):
+        while self._running:
+            item = self._next_line()
+            if item is None:
+                return
+            line, length = item
+            time.sleep(self.line_time)
+            with self._rx_cond:
+                del self._rx[:length]
+            command = line.decode('ascii', 'replace').strip()
+            self.lines.append(command)
+            self._send(self.execute(command))
+            if command.upper() == 'M0':
+                with self._rx_cond:
+                    self.state = 'Hold:0'
+                    self._resume.clear()
+                while self._running and not self._resume.wait(0.1):
+                    pass
+
+    def execute(self, command: str) -> str:
+        command = command.upper().replace(' ', '')
+        if not command or command.startswith('$'):
+            if command.startswith('$J='):
+                return self._move(command[3:], jog=True)
+            return 'ok'
+        if not command[0].isalpha():
+            return 'error:1'
+        return self._move(command)
+
+    def _move(self, command: str, jog=False) -> str:
+        words = WORD_REGEX.findall(command)
+        if ''.join(letter + value for letter, value in words) != command:
+            return 'error:2'
+        absolute = self.absolute
+        for letter, value in words:
+            if letter not in SUPPORTED_WORDS:
+                return 'error:20'
+            if letter == 'G' and value in ('90', '91'):
+                absolute = value == '90'
+        if not jog:
+            self.absolute = absolute
+        for letter, value in words:
+            if letter in 'XYZ':
+                axis = 'XYZ'.index(letter)
+                if absolute:
+                    self.position[axis] = float(value)
+                else:
+                    self.position[axis] += float(value)
+        return 'ok'
+
+
+if __name__ == '__main__':
+    from machine.grbl import GRBL
+
+    sim = GRBLSimulator().start()
+    machine = GRBL(sim.port)
+    program = [f'G1X{i % 50}Y{i // 50}F3000' for i in range(500)]
+    started = time.monotonic()
+    futures = machine.stream(program)
+    for future in futures:
+        future.result()
+    elapsed = time.monotonic() - started
+    print(f'{len(futures)} lines in {elapsed:.2f}s, rx peak {sim.rx_peak}, '
+          f'overflows {sim.overflows}, position {sim.position}')
+    machine.close()
+    sim.stop()
@@ -0,0 +1,157 @@
+import typing
+
+STATES = frozenset(
+    ('Idle', 'Run', 'Hold', 'Jog', 'Alarm', 'Door', 'Check', 'Home', 'Sleep')
+)
+
+
+def _floats(value: str) -> typing.Tuple[float, ...]:
+    values = value.split(',')
+    if len(values) == 3:
+        x, y, z = values
+        return float(x), float(y), float(z)
+    return tuple(map(float, values))
+
+
+def _offset(position, offset, sign):
+    if len(position) == 3 and len(offset) == 3:
+        return (
+            position[0] + sign * offset[0],
+            position[1] + sign * offset[1],
+            position[2] + sign * offset[2],
+        )
+    return tuple(p + sign * o for p, o in zip(position, offset))
+
+
+class MachineStatus:
+    """
+    One GRBL status report. Positions are float tuples in mm and are parsed
+    eagerly, the remaining fields are kept as raw text and converted on
+    access; fields the report did not carry are None. Never mutated once
+    built, so it can be shared between threads as a snapshot.
+    """
+
+    __slots__ = (
+        'state',
+        'substate',
+        'machine_position',
+        'work_position',
+        'work_offset',
+        'received_at',
+        '_fields',
+    )
+
+    def __init__(self, state: str, substate: str = None, fields: dict = None):
+        self.state = state
+        self.substate = substate
+        self.machine_position = None
+        self.work_position = None
+        self.work_offset = None
+        self.received_at = None
+        self._fields = fields if fields is not None else {}
+
+    def _int(self, *names) -> typing.Optional[int]:
+        for name in names:
+            value = self._fields.get(name)
+            if value is not None:
+                return int(value.split(',')[0])
+        return None
+
+    @property
+    def buffer(self) -> typing.Optional[int]:
+        """Free planner blocks (1.1 Bf) or queued blocks (0.9 Buf)"""
+        return self._int('Bf', 'Buf')
+
+    @property
+    def rx(self) -> typing.Optional[int]:
+        value = self._fields.get('Bf')
+        if value is not None:
+            return int(value.split(',')[1])
+        return self._int('RX')
+
+    @property
+    def line(self) -> typing.Optional[int]:
+        return self._int('Ln')
+
+    @property
+    def feed(self) -> typing.Optional[float]:
+        value = self._fields.get('FS', self._fields.get('F'))
+        return None if value is None else float(value.split(',')[0])
+
+    @property
+    def spindle(self) -> typing.Optional[float]:
+        value = self._fields.get('FS')
+        return None if value is None else float(value.split(',')[1])
+
+    @property
+    def pins(self) -> typing.Optional[str]:
+        return self._fields.get('Pn', self._fields.get('Lim'))
+
+    @property
+    def overrides(self) -> typing.Optional[typing.Tuple[int, ...]]:
+        value = self._fields.get('Ov')
+        return None if value is None else tuple(map(int, value.split(',')))
+
+    def __repr__(self):
+        return (
+            f'MachineStatus({self.state!r}, MPos={self.machine_position}, '
+            f'WPos={self.work_position}, WCO={self.work_offset})'
+        )
+
+
+def parse_status(
+    line: str, previous: MachineStatus = None
+) -> typing.Optional[MachineStatus]:
+    """
+    Parses a GRBL 0.9 or 1.1 status report ('<...>'), returns None for any
+    other line. 1.1 sends WCO only every few reports, the last known offset
+    is taken from previous to fill in whichever of MPos/WPos is missing.
+    """
+    if len(line) < 3 or line[0] != '<' or line[-1] != '>':
+        return None
+    body = line[1:-1]
+    fields = {}
+    if '|' in body:
+        head, *parts = body.split('|')
+        for part in parts:
+            name, _, value = part.partition(':')
+            fields[name] = value
+    else:
+        # 0.9 separates fields and values with the same comma:
+        # Idle,MPos:1.000,2.000,3.000,WPos:...,Buf:0,RX:0
+        head, *tokens = body.split(',')
+        name = None
+        for token in tokens:
+            if ':' in token:
+                name, _, value = token.partition(':')
+                fields[name] = value
+            elif name is not None:
+                fields[name] += ',' + token
+
+    state, _, substate = head.partition(':')
+    if state not in STATES:
+        return None
+    status = MachineStatus(state, substate or None, fields)
+
+    try:
+        value = fields.get('MPos')
+        if value is not None:
+            status.machine_position = _floats(value)
+        value = fields.get('WPos')
+        if value is not None:
+            status.work_position = _floats(value)
+        value = fields.get('WCO')
+        if value is not None:
+            status.work_offset = _floats(value)
+    except ValueError:
+        return None
+
+    offset = status.work_offset
+    if offset is None and previous is not None:
+        offset = status.work_offset = previous.work_offset
+    if offset is not None:
+        if status.work_position is None and status.machine_position is not None:
+            status.work_position = _offset(status.machine_position, offset, -1)
+        elif status.machine_position is None and status.work_position is not None:
+            status.machine_position = _offset(status.work_position, offset, 1)
+    return status
@@ -1,7 +1,7 @@
 import logging
 import os
 
-from modules.app import ScannerApp
+from modules.app import MACHINE_PORT_AUTO, ScannerApp
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,15 +12,73 @@ if __name__ == "__main__":
     IMAGE_PATH = os.getenv("STILL_IMAGE_PATH", None)
     FPS = int(os.getenv("FPS_LIMIT", 30))
     USE_STILL_IMAGE = os.getenv("USE_STILL", False)
-    MACHINE_PORT = os.getenv("MACHINE_PORT", "COM6")
+    # unset: the app looks for the controller while the preview starts,
+    # without one found it runs without a machine
+    MACHINE_PORT = os.getenv("MACHINE_PORT") or MACHINE_PORT_AUTO
+    # also send the probe to USB serial devices that are no known GRBL board
+    PROBE_ALL_PORTS = bool(int(os.getenv("PROBE_ALL_PORTS", 0)))
+    GREY_FIRST = bool(int(os.getenv("GREY_FIRST", 0)))
+    THREADED = bool(int(os.getenv("THREADED", 0)))
+    STATUS_INTERVAL = float(os.getenv("STATUS_INTERVAL", 0.1))
+    SCAN_EXTENT = os.getenv("SCAN_EXTENT", None)
+    if SCAN_EXTENT:
+        SCAN_EXTENT = tuple(float(v) for v in SCAN_EXTENT.split(","))
+    MM_PER_PX = float(os.getenv("MM_PER_PX", 0)) or None
+    EXPOSURE = float(os.getenv("EXPOSURE", 0)) or None
+    CALIBRATION_PATH = os.getenv("CALIBRATION_PATH", None)
+    UNDISTORT = os.getenv("UNDISTORT", "points")
+    REPLAY_PATH = os.getenv("REPLAY_PATH", None)
+    RECORD_PATH = os.getenv("RECORD_PATH", None)
+    METRICS_PORT = int(os.getenv("METRICS_PORT", 0)) or None
+    HUD = bool(int(os.getenv("HUD", 0)))
+    DRILL_FILE = os.getenv("DRILL_FILE", None)
+    DISPLAY = os.getenv("DISPLAY_BACKEND", "opencv")
+    # rpm, drill jobs are refused without it
+    SPINDLE_SPEED = int(os.getenv("SPINDLE_SPEED", 0)) or None
     print(MACHINE_PORT)
     if USE_STILL_IMAGE:
         app = ScannerApp(
-            machine_port=MACHINE_PORT, still_image=IMAGE_PATH, fps_limit=FPS
+            machine_port=MACHINE_PORT,
+            still_image=IMAGE_PATH,
+            fps_limit=FPS,
+            grey_first=GREY_FIRST,
+            threaded=THREADED,
+            status_interval=STATUS_INTERVAL,
+            scan_extent=SCAN_EXTENT,
+            mm_per_px=MM_PER_PX,
+            exposure=EXPOSURE,
+            calibration_path=CALIBRATION_PATH,
+            undistort=UNDISTORT,
+            replay=REPLAY_PATH,
+            record_path=RECORD_PATH,
+            metrics_port=METRICS_PORT,
+            hud=HUD,
+            drill_file=DRILL_FILE,
+            display=DISPLAY,
+            spindle_speed=SPINDLE_SPEED,
+            probe_unknown_ports=PROBE_ALL_PORTS,
         )
     else:
         app = ScannerApp(
-            machine_port=MACHINE_PORT, webcam_index=CAMERA_INDEX, fps_limit=FPS
+            machine_port=MACHINE_PORT,
+            webcam_index=CAMERA_INDEX,
+            fps_limit=FPS,
+            grey_first=GREY_FIRST,
+            threaded=THREADED,
+            status_interval=STATUS_INTERVAL,
+            scan_extent=SCAN_EXTENT,
+            mm_per_px=MM_PER_PX,
+            exposure=EXPOSURE,
+            calibration_path=CALIBRATION_PATH,
+            undistort=UNDISTORT,
+            replay=REPLAY_PATH,
+            record_path=RECORD_PATH,
+            metrics_port=METRICS_PORT,
+            hud=HUD,
+            drill_file=DRILL_FILE,
+            display=DISPLAY,
+            spindle_speed=SPINDLE_SPEED,
+            probe_unknown_ports=PROBE_ALL_PORTS,
         )
 
     app.run()
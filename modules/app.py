@@ -1,5 +1,7 @@
 import json
 import os
+import threading
+import time
 import typing
 
 from fps_limiter import LimitFPS
@@ -16,17 +18,48 @@ from modules import (
     HOLE_SIZE_MIN_KEY,
     HOLE_SIZE_MAX_KEY,
 )
+from modules.calibration import (
+    Calibration,
+    CalibrationSession,
+    PlaneTransform,
+    UNDISTORT_POINTS,
+    UNDISTORT_ROI,
+)
 from modules.camera import Droidcam
+from modules.detection import detect_blobs, draw_blobs
+from modules.display import DISPLAY_OPENCV, make_display
+from modules.drill import load_holes, plan_drill_job
+from modules.registration import DesignHoles, register
+from modules.scan import (
+    BoardScanner,
+    ContinuousScanner,
+    exposure_seconds,
+    merge_holes,
+)
+from modules.tracking import HoleTracker
+from modules.metrics import Hud, Metrics, MetricsServer
+from modules.recording import FrameRecorder
+from modules.pipeline import (
+    DropOldestQueue,
+    FramePacket,
+    LatencyMeter,
+    Stage,
+    sleep_until,
+)
 from modules.utils import (
-    apply_brightness_contrast,
-    mk_trakbar,
+    BrightnessContrastLUT,
+    reuse_buffer,
+    point2int,
     drawAxis,
     combine_two_color_images_with_anchor,
-    get_contour_extremes,
 )
+from tools.uart import find_grbl
 import numpy as np
 import cv2
 
+# machine_port that looks for the controller on the connector thread
+MACHINE_PORT_AUTO = "auto"
+
 
 class SearchWindow:
     def __init__(self, x: int, y: int, width: int, height: int):
@@ -60,27 +93,128 @@ class ScannerApp:
         webcam_index: int = 0,
         still_image: typing.Union[str, os.PathLike] = None,
         use_default_session_settings: bool = False,
+        grey_first: bool = False,
+        threaded: bool = False,
+        status_interval: float = 0.1,
+        scan_extent: typing.Tuple[float, float, float, float] = None,
+        mm_per_px: float = None,
+        exposure: float = None,
+        calibration_path: typing.Union[str, os.PathLike] = None,
+        undistort: str = UNDISTORT_POINTS,
+        replay: typing.Union[str, os.PathLike] = None,
+        record_path: typing.Union[str, os.PathLike] = None,
+        headless: bool = False,
+        metrics_port: int = None,
+        hud: bool = False,
+        connect_async: bool = True,
+        drill_file: str = None,
+        display: str = DISPLAY_OPENCV,
+        spindle_speed: int = None,
+        probe_unknown_ports: bool = False,
     ):
         self.is_running = False
         self._machine_port = machine_port
-        self.machine = self._setup_machine()
+        self._probe_unknown_ports = probe_unknown_ports
+        self._status_interval = status_interval
+        # (center, machine position) of the holes found in the last frame,
+        # centres smoothed by the tracker, tracks holds their ids/confidence
+        self.detections = []
+        self.tracks = []
+        self._tracker = HoleTracker()
+        # stage timings, only collected when exported or shown
+        self.metrics = Metrics(enabled=bool(metrics_port) or hud)
+        self._hud = Hud(self.metrics)
+        self._hud.visible = hud
+        self._metrics_server = (
+            MetricsServer(self.metrics, metrics_port).start() if metrics_port else None
+        )
+        # without a port the app only runs the vision pipeline. With
+        # connect_async the preview starts right away and self.machine is
+        # set once GRBL is ready; until then the app behaves as without one.
+        # MACHINE_PORT_AUTO probes the USB serial ports first, those without
+        # a known GRBL bridge chip only with probe_unknown_ports
+        self.machine = None
+        self._closing = False
+        self._machine_lock = threading.Lock()
+        self._connector = None
+        if machine_port and connect_async:
+            self._connector = threading.Thread(
+                target=self._connect_machine, name="connect machine", daemon=True
+            )
+            self._connector.start()
+        elif machine_port:
+            self.machine = self._setup_machine()
+        # no window, trackbars or keyboard, for benchmarks and CI
+        self._headless = headless
         self._window_name = window_name
+        # "opencv" or "dearpygui", see display.py
+        self._display = None if headless else make_display(display, window_name)
         self._fps_limit = fps_limit
         self._use_default_session_settings = use_default_session_settings
         self.settings_path = f"{window_name}_settings.json"
+        self.holes_path = f"{window_name}_holes.csv"
+        self.drill_path = f"{window_name}_drill.nc"
+        self._scan_extent = scan_extent
+        self._mm_per_px = mm_per_px
+        # seconds, for the continuous scan feed; taken from the camera if unset
+        self._exposure = exposure
+        self._scanner = None
+        self.board_holes = np.zeros((0, 2))
+        # tool diameters when the holes come from a registered drill file
+        self.board_hole_sizes = None
+        # mean blob areas (px) when they come from a board scan
+        self.board_hole_areas = None
+        self._drill_thread = None
+        self._drill_futures = []
+        # rpm for drill jobs, no job is streamed without it
+        self._spindle_speed = spindle_speed
+        # design holes, placed on the board from a few views with 'r'
+        self.design = DesignHoles.from_file(drill_file) if drill_file else None
+        self.registration = None
+        self._registration_views = []
 
         self.SESSION_SETTINGS = self._load_session_settings()
         self._webcam_index = webcam_index
         self._still_image = still_image
 
         self._fps_limiter = LimitFPS(fps=self._fps_limit)
+        self._brightness_contrast = BrightnessContrastLUT()
+        self._grey_first = grey_first
+        self._grey_buf = None
+        self._display_buf = None
+        self._threaded = threaded
+        self._capture_queue = DropOldestQueue(maxsize=1)
+        self._display_queue = DropOldestQueue(maxsize=1)
+        self.latency = LatencyMeter()
+        self._last_settings = None
+        # "points" corrects only the detected centres, "roi" remaps the
+        # search window and "frame" the whole image before filtering
+        self._calibration = (
+            Calibration.from_file(calibration_path) if calibration_path else None
+        )
+        self._undistort = undistort
+        self._undistort_buf = None
+        self.calibration_path = calibration_path or f"{window_name}_calibration.npz"
+        self._calibration_session = None
+        # pixels to board mm, replaced by set_marker_pose once the board
+        # markers have been solved
+        self._transform = None
+        if mm_per_px:
+            self._transform = PlaneTransform.from_scale(mm_per_px, self._calibration)
+        # work coordinates of the holes in the last frame, for jogging to
+        self.hole_targets = np.zeros((0, 2))
+        self._replay = replay
         self._camera = self._setup_camera()
+        # raw frames with capture time and machine position, see recording.py
+        self._recorder = FrameRecorder(record_path) if record_path else None
 
         img = self._camera.read()
         max_height, max_width = img.shape[:2]
-        self._setup_window()
         self._search_window = None
-        self._setup_trackbars(max_width, max_height)
+        if not self._headless:
+            self._display.open(
+                self.SESSION_SETTINGS, self._setting_limits(max_width, max_height)
+            )
 
     def _load_session_settings(self) -> dict:
         default_settings = {
@@ -121,12 +255,7 @@ class ScannerApp:
             )
         return img
 
-    def _detect_holes(
-        self, img: np.ndarray, thresh: np.ndarray
-    ) -> (np.ndarray, typing.List):
-        centers = []
-        filtered_contours = []
-        thresh = cv2.bitwise_not(thresh)
+    def _update_search_window(self, img: np.ndarray) -> SearchWindow:
         img_height, img_width = img.shape[:2]
         roi_width = self.SESSION_SETTINGS.get(ROI_WIDTH_KEY) | 2
         roi_height = self.SESSION_SETTINGS.get(ROI_HEIGHT_KEY) | 2
@@ -138,117 +267,607 @@ class ScannerApp:
             self._search_window.update_bounds(
                 img_width // 2, img_height // 2, roi_width, roi_height
             )
+        return self._search_window
 
-        roi_part = self._search_window.get_roi(thresh)
-        contours, _ = cv2.findContours(
-            roi_part, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+    def _threshold_roi(self, grey_roi: np.ndarray) -> np.ndarray:
+        # holes are dark on the board, invert so they become foreground
+        _, thresh = cv2.threshold(
+            grey_roi,
+            self.SESSION_SETTINGS.get(THRESHOLD_KEY),
+            255,
+            cv2.THRESH_BINARY_INV,
+            dst=grey_roi,
         )
+        return thresh
 
-        for cnt in contours:
-            area = cv2.contourArea(cnt)
-            if (
-                self.SESSION_SETTINGS.get(HOLE_SIZE_MIN_KEY)
-                < area
-                < self.SESSION_SETTINGS.get(HOLE_SIZE_MAX_KEY)
-            ):
-                filtered_contours.append(cnt)
-
-        roi_part = cv2.cvtColor(roi_part, cv2.COLOR_GRAY2BGR)
-        if filtered_contours:
-            for cnt in filtered_contours:
-                cv2.drawContours(roi_part, [cnt], 0, (255, 0, 0), 1)
-                center = get_contour_extremes(cnt)
-                centers.append(self._search_window.offset_point(center))
+    def _detect_holes(
+        self, img: np.ndarray, thresh: np.ndarray
+    ) -> (np.ndarray, np.ndarray):
+        """
+        thresh is the inverted binary image of the search window only,
+        as produced by _apply_filters. Returns the sub-pixel centres as an
+        (N, 2) float array in frame coordinates.
+        """
+        blobs = detect_blobs(
+            thresh,
+            self.SESSION_SETTINGS.get(HOLE_SIZE_MIN_KEY),
+            self.SESSION_SETTINGS.get(HOLE_SIZE_MAX_KEY),
+        )
+        centers = blobs.centroids + (self._search_window.bx, self._search_window.by)
+        roi_part = cv2.cvtColor(thresh, cv2.COLOR_GRAY2BGR)
+        draw_blobs(roi_part, blobs)
         combine_two_color_images_with_anchor(
             img, roi_part, self._search_window.bx, self._search_window.by
         )
         return img, centers
 
-    def _setup_window(self):
-        cv2.namedWindow(self._window_name)
+    def _setting_limits(self, max_width: int, max_height: int) -> typing.Dict[str, int]:
+        """Maximum of every setting with a trackbar or slider, in display order"""
+        return {
+            BRIGHTNESS_KEY: 255,
+            CONTRAST_KEY: 255,
+            THRESHOLD_KEY: 255,
+            BW_KEY: 1,
+            ROI_WIDTH_KEY: max_width - 1,
+            ROI_HEIGHT_KEY: max_height - 1,
+            HOLE_SIZE_MIN_KEY: 100000,
+            HOLE_SIZE_MAX_KEY: 3069797,
+        }
+
+    def _display_buffer(self, shape: tuple, dtype) -> np.ndarray:
+        # frames handed to the display thread must not be overwritten by the
+        # next processing step, so buffers are only reused single-threaded
+        if self._threaded:
+            return np.empty(shape, dtype=dtype)
+        self._display_buf = reuse_buffer(self._display_buf, shape, dtype)
+        return self._display_buf
 
-    def _setup_trackbars(self, max_width: int, max_height: int):
-        mk_trakbar(self._window_name, self.SESSION_SETTINGS, BRIGHTNESS_KEY, 255)
-        mk_trakbar(self._window_name, self.SESSION_SETTINGS, CONTRAST_KEY, 255)
-        mk_trakbar(self._window_name, self.SESSION_SETTINGS, THRESHOLD_KEY, 255)
-        mk_trakbar(self._window_name, self.SESSION_SETTINGS, BW_KEY, 1)
-        mk_trakbar(self._window_name, self.SESSION_SETTINGS, ROI_WIDTH_KEY, max_width-1)
-        mk_trakbar(self._window_name, self.SESSION_SETTINGS, ROI_HEIGHT_KEY, max_height-1)
-        mk_trakbar(self._window_name, self.SESSION_SETTINGS, HOLE_SIZE_MIN_KEY, 100000)
-        mk_trakbar(self._window_name, self.SESSION_SETTINGS, HOLE_SIZE_MAX_KEY, 3069797)
+    def _apply_filters_grey(self, img: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        BW path that never runs brightness/contrast on colour: the search
+        window is greyed first (or used as is when the camera already
+        delivers a single channel) and the colour image is only copied for
+        the overlay
+        """
+        roi = self._update_search_window(img).get_roi(img)
+        if img.ndim == 2:
+            self._grey_buf = reuse_buffer(self._grey_buf, roi.shape, roi.dtype)
+            np.copyto(self._grey_buf, roi)
+            display = self._display_buffer(img.shape + (3,), img.dtype)
+            cv2.cvtColor(img, cv2.COLOR_GRAY2BGR, dst=display)
+        else:
+            self._grey_buf = reuse_buffer(self._grey_buf, roi.shape[:2], roi.dtype)
+            cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY, dst=self._grey_buf)
+            display = self._display_buffer(img.shape, img.dtype)
+            np.copyto(display, img)
+        grey = self._brightness_contrast(
+            self._grey_buf,
+            self.SESSION_SETTINGS.get(BRIGHTNESS_KEY),
+            self.SESSION_SETTINGS.get(CONTRAST_KEY),
+            inplace=True,
+        )
+        return display, self._threshold_roi(grey)
 
     def _apply_filters(self, img: np.ndarray) -> (np.ndarray, np.ndarray):
-        img = apply_brightness_contrast(
+        """
+        Returns the frame to display and, in BW mode, the inverted threshold
+        of the search window only
+        """
+        if self._grey_first and self.SESSION_SETTINGS.get(BW_KEY):
+            return self._apply_filters_grey(img)
+        img = self._brightness_contrast(
             img,
             self.SESSION_SETTINGS.get(BRIGHTNESS_KEY),
             self.SESSION_SETTINGS.get(CONTRAST_KEY),
+            out=np.empty_like(img) if self._threaded else None,
         )
         thresh = None
         if self.SESSION_SETTINGS.get(BW_KEY):
-            grey = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            _, thresh = cv2.threshold(
-                grey,
-                self.SESSION_SETTINGS.get(THRESHOLD_KEY),
-                255,
-                cv2.THRESH_BINARY,
-            )
+            roi = self._update_search_window(img).get_roi(img)
+            self._grey_buf = reuse_buffer(self._grey_buf, roi.shape[:2], roi.dtype)
+            grey = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY, dst=self._grey_buf)
+            thresh = self._threshold_roi(grey)
         return img, thresh
 
     def _draw_center(
-        self, img: np.ndarray, center: typing.Tuple[int, int]
+        self, img: np.ndarray, center: typing.Tuple[float, float]
     ) -> np.ndarray:
+        point = point2int(center)
         drawAxis(img, center, (0, 0, 255), 0)
         drawAxis(img, center, (0, 0, 255), HALFPI)
-        cv2.circle(img, center, 5, (0, 0, 255), cv2.FILLED)
+        cv2.circle(img, point, 5, (0, 0, 255), cv2.FILLED)
+        cv2.putText(
+            img,
+            f"({center[0]:.1f}, {center[1]:.1f})",
+            point,
+            cv2.FONT_HERSHEY_SIMPLEX,
+            1,
+            (0, 0, 255),
+            2,
+        )
+        return img
+
+    def _draw_machine_status(self, img: np.ndarray, status) -> np.ndarray:
+        if status is None:
+            return img
+        x, y, z = status.machine_position[:3]
         cv2.putText(
-            img, str(center), center, cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2
+            img,
+            f"{status.state} X{x:.3f} Y{y:.3f} Z{z:.3f}{self._scan_progress()}",
+            (10, 30),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            1,
+            (0, 255, 255),
+            2,
         )
         return img
 
+    def _scan_progress(self) -> str:
+        if self._scanner is None or not self._scanner.is_running:
+            return ""
+        return f" SCAN {self._scanner.progress}/{len(self._scanner.stops or ())}"
+
     def _draw_centers(self, img: np.ndarray, centers: typing.List) -> np.ndarray:
         for center in centers:
             self._draw_center(img, center)
         return img
 
     def _setup_camera(self) -> Droidcam:
+        if self._replay:
+            return Droidcam(use_webcam=False, replay_src=self._replay)
         if self._still_image:
             return Droidcam(use_webcam=False, img_src=self._still_image)
         else:
             return Droidcam(use_webcam=True, webcam_index=self._webcam_index)
 
-    def _setup_machine(self) -> GRBL:
+    def _connect_machine(self):
+        try:
+            machine = self._setup_machine()
+        except Exception as e:
+            print("MACHINE FAILED", e)
+            return
+        if machine is None:
+            return
+        with self._machine_lock:
+            if not self._closing:
+                self.machine = machine
+                return
+        # the app quit while connecting
+        machine.close()
+
+    def _setup_machine(self) -> typing.Optional[GRBL]:
+        if self._machine_port == MACHINE_PORT_AUTO:
+            self._machine_port = find_grbl(probe_unknown=self._probe_unknown_ports)
+            if self._machine_port is None:
+                print("MACHINE no GRBL controller found")
+                return None
         machine = GRBL(port=self._machine_port)
         # machine.reset()
-        machine.send_wake_up()
+        if machine.wake_up():
+            print("MACHINE", machine.banner or "ready")
+        else:
+            print("MACHINE no answer from", self._machine_port)
         # machine.home()
+        if self._status_interval:
+            machine.start_status_polling(self._status_interval)
+        machine.subscribe(self.metrics.on_machine_event)
         return machine
 
     def get_point_offest_from_image_center(self,img: np.ndarray, point: typing.Tuple[int, int]):
-        img_width, img_height = img.shape[:2]
+        img_height, img_width = img.shape[:2]
         return (
             point[0] - img_width // 2,
             point[1] - img_height // 2,
         )
 
-    def _cycle(self):
-        frame = self._camera.read()
-        frame, thresh = self._apply_filters(frame)
+    def get_point_offset_mm(
+        self, img: np.ndarray, point: typing.Tuple[float, float], undistorted=False
+    ) -> np.ndarray:
+        """
+        Machine X/Y mm from the position under the image centre to point.
+        Centres found by _process are undistorted whenever a calibration is
+        loaded.
+        """
+        if self._transform is None:
+            raise ValueError("no plane transform, set mm_per_px or a marker pose")
+        return self._transform.to_offsets([point], img.shape, undistorted)[0]
+
+    def set_marker_pose(self, rvec, tvec):
+        """Board plane pose, e.g. as returned by solve_marker_plane"""
+        self._transform = PlaneTransform.from_pose(self._calibration, rvec, tvec)
+
+    def _hole_targets(self, frame: np.ndarray, centers, status) -> np.ndarray:
+        if self._transform is None or status is None or not len(centers):
+            return np.zeros((0, 2))
+        offsets = self._transform.to_offsets(
+            centers, frame.shape, undistorted=self._calibration is not None
+        )
+        return np.asarray(status.work_position[:2]) + offsets
+
+    def go_to_nearest_hole(self):
+        if self.machine is None:
+            return
+        if self._transform is None:
+            print("GO TO needs mm_per_px or a marker pose")
+            return
+        if not len(self.hole_targets):
+            return
+        position = np.asarray(self.machine.work_position[:2])
+        distances = np.linalg.norm(self.hole_targets - position, axis=1)
+        x, y = self.hole_targets[np.argmin(distances)]
+        # the ok comes from the reader thread, the preview keeps running
+        self.machine.go_to(round(x, 3), round(y, 3), wait_ok=False)
+
+    def _undistort_frame(self, frame: np.ndarray) -> np.ndarray:
+        # only read by the processing step, so reused in threaded mode too
+        self._undistort_buf = reuse_buffer(
+            self._undistort_buf, frame.shape, frame.dtype
+        )
+        if self._undistort == UNDISTORT_ROI:
+            w = self._update_search_window(frame)
+            return self._calibration.undistort_roi(
+                frame, w.bx, w.by, w.tx, w.ty, out=self._undistort_buf
+            )
+        return self._calibration.undistort(frame, out=self._undistort_buf)
+
+    def _undistort_points(self, points: np.ndarray) -> np.ndarray:
+        if self._calibration is None or self._undistort != UNDISTORT_POINTS:
+            return points
+        return self._calibration.undistort_points(points)
+
+    def _display_points(self, points: typing.List) -> typing.List:
+        """
+        Undistorted centres back onto the frame they are drawn on, which
+        stays distorted when only the points are corrected
+        """
+        if (
+            not points
+            or self._calibration is None
+            or self._undistort != UNDISTORT_POINTS
+        ):
+            return points
+        return [tuple(p) for p in self._calibration.distort_points(points)]
+
+    def _process(self, frame: np.ndarray) -> (np.ndarray, typing.List):
+        centers = []
+        # one snapshot per frame, the poller replaces it as a whole
+        status = self.machine.status if self.machine is not None else None
+        # read once, the keyboard can end the session while this runs
+        session = self._calibration_session
+        if session is not None:
+            session.offer(frame)
+        metrics = self.metrics
+        if self._calibration is not None and self._undistort != UNDISTORT_POINTS:
+            with metrics.stage("undistort"):
+                frame = self._undistort_frame(frame)
+        with metrics.stage("filters"):
+            frame, thresh = self._apply_filters(frame)
         if thresh is not None:
-            frame, centers = self._detect_holes(frame, thresh)
-            frame = self._draw_centers(frame, centers)
-        frame = self._draw_roi(frame)
-        cv2.imshow(self._window_name, frame)
+            with metrics.stage("detect"):
+                frame, detected = self._detect_holes(frame, thresh)
+                detected = self._undistort_points(detected)
+                self.tracks = self._tracker.update(detected)
+                centers = [tuple(track.center) for track in self.tracks]
+        else:
+            self._tracker.reset()
+            self.tracks = []
+        position = status.machine_position if status is not None else None
+        self.detections = [(center, position) for center in centers]
+        self.hole_targets = self._hole_targets(frame, centers, status)
+        with metrics.stage("draw"):
+            frame = self._draw_centers(frame, self._display_points(centers))
+            frame = self._draw_roi(frame)
+            frame = self._draw_machine_status(frame, status)
+            if session is not None:
+                frame = session.draw(frame)
+            frame = self._hud.draw(frame)
+        return frame, centers
+
+    def _next_frame(self, timeout: float) -> (np.ndarray, float):
+        """
+        Waits for a frame the app has not processed yet. The last frame is
+        processed again only when the session settings changed, otherwise
+        returns (None, None)
+        """
+        frame = self._camera.read_new(timeout)
+        frame_time = self._camera.frame_time
+        if frame is not None and self._recorder is not None:
+            position = None
+            if self.machine is not None:
+                position = self.machine.status.machine_position
+            self._recorder.write(frame, frame_time, position)
+        settings = tuple(self.SESSION_SETTINGS.values())
+        if frame is None and settings != self._last_settings:
+            frame, frame_time = self._camera.read(), time.monotonic()
+        self._last_settings = settings
+        if frame is None:
+            return None, None
+        return frame, frame_time
+
+    def _cycle(self):
+        with self.metrics.stage("capture"):
+            frame, _ = self._next_frame(timeout=1.0 / self._fps_limit)
+        if frame is None:
+            return
+        frame, _ = self._process(frame)
+        if not self._headless:
+            with self.metrics.stage("display"):
+                self._display.show(frame)
+
+    def _capture_step(self):
+        deadline = time.monotonic() + 1.0 / self._fps_limit
+        with self.metrics.stage("capture"):
+            frame, frame_time = self._next_frame(timeout=0.1)
+        if frame is not None:
+            self._capture_queue.put(FramePacket(frame, frame_time))
+        sleep_until(deadline)
+
+    def _process_step(self):
+        packet = self._capture_queue.get(timeout=0.1)
+        if packet is None:
+            return
+        packet.frame, packet.centers = self._process(packet.frame)
+        packet.processed_at = time.monotonic()
+        self.latency.add(packet.latency)
+        self.metrics.add("latency", packet.latency)
+        self._display_queue.put(packet)
+
+    def _run_threaded(self):
+        """
+        Capture and processing run on their own threads, the display stays
+        on the calling thread and only shows the newest processed frame
+        """
+        stages = [
+            Stage("capture", self._capture_step, lambda: self.is_running),
+            Stage("process", self._process_step, lambda: self.is_running),
+        ]
+        for stage in stages:
+            stage.start()
+        shown = 0
+        while self.is_running:
+            packet = self._display_queue.get(timeout=1.0 / self._fps_limit)
+            if self._headless:
+                continue
+            if packet is not None:
+                with self.metrics.stage("display"):
+                    self._display.show(packet.frame)
+                shown += 1
+                if shown % self._fps_limit == 0:
+                    self._display.set_title(f"{self._window_name} | {self.latency}")
+            self._keyboard_handler(self._display.poll_key())
+        for stage in stages:
+            stage.join()
+
+    def _detect_frame_holes(self, frame: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        Hole centres and blob areas over the whole frame, without drawing,
+        for board scans. The scan's PlaneTransform undistorts the centres,
+        whatever the preview mode.
+        """
+        grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        grey = self._brightness_contrast(
+            grey,
+            self.SESSION_SETTINGS.get(BRIGHTNESS_KEY),
+            self.SESSION_SETTINGS.get(CONTRAST_KEY),
+            inplace=True,
+        )
+        blobs = detect_blobs(
+            self._threshold_roi(grey),
+            self.SESSION_SETTINGS.get(HOLE_SIZE_MIN_KEY),
+            self.SESSION_SETTINGS.get(HOLE_SIZE_MAX_KEY),
+        )
+        return blobs.centroids, blobs.areas
+
+    def _on_scan_done(self, holes: np.ndarray, areas: np.ndarray):
+        self.board_holes = holes
+        self.board_hole_sizes = None
+        self.board_hole_areas = areas
+        np.savetxt(
+            self.holes_path,
+            np.column_stack((holes, areas)),
+            fmt="%.3f",
+            delimiter=",",
+            header="x,y,area",
+        )
+        print(f"{len(holes)} holes saved to {self.holes_path}")
+
+    def start_board_scan(self, continuous: bool = False):
+        if self.machine is None:
+            print("SCAN needs a machine")
+            return
+        if self._scan_extent is None or self._transform is None:
+            print("SCAN needs scan_extent and mm_per_px or a marker pose")
+            return
+        if self._scanner is not None and self._scanner.is_running:
+            return
+        if continuous:
+            exposure = self._exposure or exposure_seconds(self._camera.exposure)
+            self._scanner = ContinuousScanner(
+                self.machine,
+                self._camera.slot,
+                self._detect_frame_holes,
+                self._transform,
+                exposure=exposure,
+            )
+            print(f"SCAN continuous at F{self._scanner.feed:.0f}")
+        else:
+            self._scanner = BoardScanner(
+                self.machine,
+                self._camera.slot,
+                self._detect_frame_holes,
+                self._transform,
+            )
+        self._scanner.start(self._scan_extent, on_done=self._on_scan_done)
+
+    def _drilling(self) -> bool:
+        if self._drill_thread is not None and self._drill_thread.is_alive():
+            return True
+        # all sent, the job still runs until its last line is acknowledged
+        return bool(self._drill_futures) and not self._drill_futures[-1].done()
+
+    def _stream_drill_job(self, program: typing.List[str], on_ack):
+        self._drill_futures = self.machine.stream(program, on_ack)
+
+    def start_drill_job(self):
+        """
+        Orders the scanned holes (or those saved in holes_path, with areas
+        if it has a third column) into a drill job, classed by area between
+        the hole size limits, saves the G-code to drill_path and streams it
+        from a background thread
+        """
+        if self.machine is None:
+            print("DRILL needs a machine")
+            return
+        if self._drilling():
+            return
+        if not self._spindle_speed:
+            print("DRILL needs a spindle speed, set SPINDLE_SPEED")
+            return
+        holes, sizes = self.board_holes, self.board_hole_sizes
+        size_range = (
+            self.SESSION_SETTINGS.get(HOLE_SIZE_MIN_KEY),
+            self.SESSION_SETTINGS.get(HOLE_SIZE_MAX_KEY),
+        )
+        if sizes is not None:
+            # drill file diameters, one class per tool
+            size_range = None
+        elif len(holes):
+            sizes = self.board_hole_areas
+        elif os.path.exists(self.holes_path):
+            holes, sizes = load_holes(self.holes_path)
+        if not len(holes):
+            print("DRILL needs holes, scan the board first")
+            return
+        job = plan_drill_job(
+            holes, sizes, size_range, start=self.machine.work_position[:2]
+        )
+        program = job.gcode(self._spindle_speed)
+        job.save(self.drill_path, self._spindle_speed)
+        print(f"DRILL {len(job)} holes, {job.travel:.0f}mm travel, {self.drill_path}")
+        pauses = {n for n, line in enumerate(program, 1) if line == "M0"}
+
+        def on_ack(line_number, future):
+            if line_number in pauses and future.exception() is None:
+                print("DRILL paused, change the bit and press p to resume")
+
+        self._drill_thread = threading.Thread(
+            target=self._stream_drill_job,
+            args=(program, on_ack),
+            name="drill job",
+            daemon=True,
+        )
+        self._drill_thread.start()
+
+    def resume_drill_job(self):
+        """
+        Cycle start after the M0 pause between size classes, GRBL holds
+        until it gets one
+        """
+        print("DRILL resumed")
+        self.machine.cycle_start()
+
+    def add_registration_view(self):
+        """
+        Adds the holes in view to those matched against the drill file and
+        places the design on the board once they fit; 3-4 views spread
+        over the board are usually enough
+        """
+        if self.design is None:
+            print("REGISTRATION needs a drill file")
+            return
+        if not len(self.hole_targets):
+            print("REGISTRATION no holes in view")
+            return
+        self._registration_views.append(self.hole_targets.copy())
+        # overlapping views see the same holes
+        holes, _, _ = merge_holes(np.vstack(self._registration_views), 0.3)
+        views = len(self._registration_views)
+        registration = register(holes, self.design)
+        if registration is None:
+            print(f"REGISTRATION {views} views, {len(holes)} holes, no fit yet")
+            return
+        self.registration = registration
+        self.board_holes = registration.to_board(self.design.holes)
+        self.board_hole_sizes = self.design.diameters
+        self.board_hole_areas = None
+        print(f"REGISTRATION {views} views, {registration}")
+
+    def toggle_calibration(self):
+        """
+        Starts collecting chessboard views, or ends the session and switches
+        to its calibration, saved to calibration_path
+        """
+        session = self._calibration_session
+        if session is None:
+            self._calibration_session = CalibrationSession()
+            return
+        self._calibration_session = None
+        # a running solve finishes in the background, the window stays live
+        session.close(on_done=self._calibration_done)
+
+    def _calibration_done(self, session: CalibrationSession):
+        calibration = session.calibration()
+        if calibration is None:
+            print(f"CALIBRATION needs {session.min_views} views")
+            return
+        session.save(self.calibration_path)
+        print(f"CALIBRATION rms {session.rms:.3f}px saved to {self.calibration_path}")
+        self._calibration = calibration
+        if self._mm_per_px:
+            self._transform = PlaneTransform.from_scale(self._mm_per_px, calibration)
+
+    def toggle_hud(self):
+        self._hud.visible = not self._hud.visible
+        if self._hud.visible:
+            self.metrics.enabled = True
 
     def _stop(self):
+        if self._scanner is not None:
+            self._scanner.stop()
+        if self._calibration_session is not None:
+            self._calibration_session.close()
+        if self._recorder is not None:
+            self._recorder.close()
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+        with self._machine_lock:
+            self._closing = True
+        if self.machine is not None:
+            self.machine.close()
         self._camera.__del__()
-        self._save_session_settings()
         self.is_running = False
-        cv2.destroyAllWindows()
+        if not self._headless:
+            self._save_session_settings()
+            self._display.close()
 
     def _keyboard_handler(self, key):
         JOG_VALUE = 1
         if key == ord("q"):
             self._stop()
+        elif key == ord("b"):
+            self.start_board_scan()
+        elif key == ord("c"):
+            self.start_board_scan(continuous=True)
+        elif key == ord("k"):
+            self.toggle_calibration()
+        elif key == ord("h"):
+            self.toggle_hud()
+        elif key == ord("r"):
+            self.add_registration_view()
+        elif self.machine is None:
+            return
+        elif key == ord("p"):
+            # the one key that works while a job runs
+            self.resume_drill_job()
+        elif self._scanner is not None and self._scanner.is_running:
+            # the scan owns the machine until it is done
+            return
+        elif self._drilling():
+            return
+        elif key == ord("j"):
+            self.start_drill_job()
+        elif key == ord("g"):
+            self.go_to_nearest_hole()
         elif key == ord("w"):
             self.machine.jog(d_x=0, d_y=JOG_VALUE)
         elif key == ord("s"):
@@ -260,8 +879,17 @@ class ScannerApp:
 
     def run(self):
         self.is_running = True
+        if self._threaded:
+            self._run_threaded()
+            return
         while self.is_running:
+            if self._headless:
+                # no window to poll, read_new waits for the frame and the
+                # rest of the slot is slept instead of spinning the limiter
+                deadline = time.monotonic() + 1.0 / self._fps_limit
+                self._cycle()
+                sleep_until(deadline)
+                continue
+            self._keyboard_handler(self._display.poll_key())
             if self._fps_limiter():
-                key = cv2.waitKey(1)
-                self._keyboard_handler(key)
                 self._cycle()
@@ -0,0 +1,414 @@
+import multiprocessing
+import threading
+import typing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from modules.utils import load_calibration
+
+UNDISTORT_FRAME = "frame"
+UNDISTORT_ROI = "roi"
+UNDISTORT_POINTS = "points"
+
+CHESSBOARD_FLAGS = (
+    cv2.CALIB_CB_ADAPTIVE_THRESH
+    | cv2.CALIB_CB_NORMALIZE_IMAGE
+    | cv2.CALIB_CB_FAST_CHECK
+)
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+
+class Calibration:
+    """
+    Camera intrinsics from create_calibration/load_calibration with the
+    undistortion maps computed once per frame size. remap with the
+    fixed-point (CV_16SC2) maps gives the same image as cv2.undistort
+    without recomputing the mapping every frame; undistort_roi only remaps
+    the search window and undistort_points only the detected centres, all
+    in the coordinates of newmtx.
+    """
+
+    def __init__(self, mtx, dist, newmtx=None, roi=None):
+        self.mtx = np.asarray(mtx, dtype=np.float64)
+        self.dist = np.asarray(dist, dtype=np.float64)
+        self.newmtx = self.mtx if newmtx is None else np.asarray(newmtx, np.float64)
+        self.roi = roi
+        self._maps = {}
+
+    @classmethod
+    def from_file(cls, path: str) -> "Calibration":
+        return cls(*load_calibration(path))
+
+    def get_mtx_dist(self):
+        return self.mtx, self.dist
+
+    def maps(self, frame_shape: tuple) -> (np.ndarray, np.ndarray):
+        height, width = frame_shape[:2]
+        maps = self._maps.get((width, height))
+        if maps is None:
+            maps = cv2.initUndistortRectifyMap(
+                self.mtx, self.dist, None, self.newmtx, (width, height), cv2.CV_16SC2
+            )
+            self._maps[width, height] = maps
+        return maps
+
+    def undistort(self, frame: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        map1, map2 = self.maps(frame.shape)
+        return cv2.remap(frame, map1, map2, cv2.INTER_LINEAR, dst=out)
+
+    def undistort_roi(
+        self, frame: np.ndarray, bx: int, by: int, tx: int, ty: int, out=None
+    ) -> np.ndarray:
+        """
+        Copy of frame with only the window [by:ty, bx:tx] undistorted. The
+        maps hold absolute source coordinates, so a slice of them remaps the
+        window straight from the full distorted frame.
+        """
+        map1, map2 = self.maps(frame.shape)
+        if out is None:
+            out = np.empty_like(frame)
+        np.copyto(out, frame)
+        out[by:ty, bx:tx] = cv2.remap(
+            frame, map1[by:ty, bx:tx], map2[by:ty, bx:tx], cv2.INTER_LINEAR
+        )
+        return out
+
+    def undistort_points(self, points: typing.Sequence) -> np.ndarray:
+        """(N, 2) pixel points to where they land in the undistorted image"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        if not len(points):
+            return points.reshape(0, 2)
+        return cv2.undistortPoints(
+            points, self.mtx, self.dist, P=self.newmtx
+        ).reshape(-1, 2)
+
+    def distort_points(self, points: typing.Sequence) -> np.ndarray:
+        """Inverse of undistort_points: newmtx pixels back onto the raw frame"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if not len(points):
+            return points
+        rays = cv2.convertPointsToHomogeneous(points).reshape(-1, 3)
+        rays = rays @ np.linalg.inv(self.newmtx).T
+        projected, _ = cv2.projectPoints(
+            rays, np.zeros(3), np.zeros(3), self.mtx, self.dist
+        )
+        return projected.reshape(-1, 2)
+
+
+class PlaneTransform:
+    """
+    Image pixels to mm on the board plane, for a whole batch of points at
+    once: cv2.undistortPoints (when there is a calibration) followed by one
+    homography. homography maps undistorted pixels (newmtx coordinates), or
+    raw pixels without a calibration, to plane mm. Plane y follows image y;
+    to_offsets flips it to machine Y (up) so the result can be used as the
+    scale of a board scan.
+    """
+
+    def __init__(
+        self, homography, calibration: Calibration = None, flip_y: bool = True
+    ):
+        self.homography = np.asarray(homography, dtype=np.float64)
+        self.calibration = calibration
+        self.flip_y = flip_y
+        # local scale at the principal point, for feeds and plan steps
+        if calibration is not None:
+            reference = calibration.newmtx[:2, 2]
+        else:
+            reference = np.zeros(2)
+        origin, dx, dy = self._map(reference + np.array([(0, 0), (1, 0), (0, 1)]))
+        (ax, ay), (bx, by) = dx - origin, dy - origin
+        self.mm_per_px = float(np.sqrt(abs(ax * by - ay * bx)))
+
+    @classmethod
+    def from_scale(
+        cls, mm_per_px: float, calibration: Calibration = None, **kwargs
+    ):
+        return cls(np.diag((mm_per_px, mm_per_px, 1.0)), calibration, **kwargs)
+
+    @classmethod
+    def from_pose(cls, calibration: Calibration, rvec, tvec, **kwargs):
+        """
+        Plane z=0 of the pose found by solvePnP (e.g. solve_marker_plane),
+        in the units of its model points
+        """
+        rotation, _ = cv2.Rodrigues(np.asarray(rvec, dtype=np.float64))
+        extrinsic = np.column_stack(
+            (rotation[:, 0], rotation[:, 1], np.asarray(tvec, np.float64).ravel())
+        )
+        homography = np.linalg.inv(extrinsic) @ np.linalg.inv(calibration.newmtx)
+        return cls(homography / homography[2, 2], calibration, **kwargs)
+
+    @classmethod
+    def from_correspondences(
+        cls, image_points, plane_points, calibration: Calibration = None, **kwargs
+    ):
+        """Homography fitted to at least four known points, e.g. markers"""
+        image_points = np.asarray(image_points, dtype=np.float64).reshape(-1, 2)
+        if calibration is not None:
+            image_points = calibration.undistort_points(image_points)
+        homography, _ = cv2.findHomography(
+            image_points, np.asarray(plane_points, dtype=np.float64).reshape(-1, 2)
+        )
+        return cls(homography, calibration, **kwargs)
+
+    def _map(self, points: np.ndarray) -> np.ndarray:
+        return cv2.perspectiveTransform(
+            points.reshape(-1, 1, 2), self.homography
+        ).reshape(-1, 2)
+
+    def apply(self, points, undistorted: bool = False) -> np.ndarray:
+        """
+        (N, 2) pixel points to plane mm. undistorted tells that the points
+        are already in newmtx coordinates, as the centres found in an
+        undistorted frame or ROI are.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if not len(points):
+            return points
+        if self.calibration is not None and not undistorted:
+            points = self.calibration.undistort_points(points)
+        return self._map(points)
+
+    def field_of_view(self, frame_shape: tuple) -> (float, float):
+        height, width = frame_shape[:2]
+        left, right, top, bottom = self.apply(
+            [(0, height / 2), (width, height / 2), (width / 2, 0), (width / 2, height)]
+        )
+        return (
+            float(np.linalg.norm(right - left)),
+            float(np.linalg.norm(bottom - top)),
+        )
+
+    def to_offsets(
+        self, points, frame_shape: tuple, undistorted: bool = False
+    ) -> np.ndarray:
+        """
+        (N, 2) mm offsets of points from the point under the image centre,
+        i.e. from the machine position, in machine axis directions
+        """
+        height, width = frame_shape[:2]
+        centre = self.apply([(width / 2, height / 2)])
+        offsets = self.apply(points, undistorted) - centre
+        if self.flip_y:
+            offsets[:, 1] *= -1
+        return offsets
+
+
+def find_chessboard(
+    grey: np.ndarray, pattern: typing.Tuple[int, int], scale: float = 0.5
+) -> typing.Optional[np.ndarray]:
+    """
+    Looks for the chessboard on a downscaled copy of grey and refines the
+    corners with cornerSubPix on the full resolution image. Returns the
+    (N, 1, 2) float32 corners or None.
+    """
+    small = grey
+    if scale != 1:
+        small = cv2.resize(
+            grey, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+        )
+    found, corners = cv2.findChessboardCorners(small, pattern, None, CHESSBOARD_FLAGS)
+    if not found:
+        return None
+    # pixel centres, not corners, scale between the two images
+    corners = (corners + 0.5) / scale - 0.5
+    window = max(3, int(round(2 / scale)) + 3)
+    return cv2.cornerSubPix(
+        grey, corners, (window, window), (-1, -1), SUBPIX_CRITERIA
+    )
+
+
+def solve_calibration(object_points, image_points, size):
+    """
+    calibrateCamera over all views, returns the RMS reprojection error with
+    the values create_calibration saves. Top level so it can run in a
+    worker process.
+    """
+    rms, mtx, dist, _, _ = cv2.calibrateCamera(
+        object_points, image_points, size, None, None
+    )
+    newmtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, size, 1, size)
+    return rms, mtx, dist, newmtx, np.array(roi)
+
+
+class CalibrationSession:
+    """
+    Collects chessboard views from live frames and re-solves the camera
+    calibration in a worker process whenever a new view was added, so the
+    preview keeps running. offer() hands frames to a detector thread and
+    drops them while it is busy. Views whose corners moved less than min_motion
+    (fraction of the image diagonal, on average) from an accepted view are
+    dropped as duplicates. rms is the latest reprojection error in pixels.
+    """
+
+    def __init__(
+        self,
+        pattern: typing.Tuple[int, int] = (9, 9),
+        square: float = 1.0,
+        detect_scale: float = 0.5,
+        min_motion: float = 0.05,
+        min_views: int = 5,
+    ):
+        self.pattern = pattern
+        self.detect_scale = detect_scale
+        self.min_motion = min_motion
+        self.min_views = min_views
+        self.object_points = np.zeros((pattern[0] * pattern[1], 3), np.float32)
+        self.object_points[:, :2] = (
+            np.mgrid[0 : pattern[0], 0 : pattern[1]].T.reshape(-1, 2) * square
+        )
+        self.views = []
+        self.size = None
+        self.corners = None
+        self.rms = None
+        self.result = None
+        self.duplicates = 0
+        self._lock = threading.Lock()
+        # spawned, forking the threaded app would copy its held locks
+        self._executor = ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        )
+        self._detector = ThreadPoolExecutor(max_workers=1)
+        self._detecting = False
+        self._solving = False
+        self._solved_views = 0
+        self._closed = False
+        self._on_done = None
+
+    def _is_duplicate(self, corners: np.ndarray) -> bool:
+        if not self.views:
+            return False
+        diagonal = np.hypot(*self.size)
+        views = np.stack(self.views).reshape(len(self.views), -1, 2)
+        motion = np.linalg.norm(views - corners.reshape(1, -1, 2), axis=2)
+        return motion.mean(axis=1).min() < self.min_motion * diagonal
+
+    def offer(self, frame: np.ndarray):
+        if self._detecting or self._closed:
+            return
+        self._detecting = True
+        if frame.ndim == 2:
+            grey = frame.copy()
+        else:
+            grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        try:
+            self._detector.submit(self._detect, grey)
+        except RuntimeError:
+            # closed by another thread since the check
+            self._detecting = False
+
+    def _detect(self, grey: np.ndarray):
+        try:
+            self.add_frame(grey)
+        except Exception as e:
+            print("CALIBRATION DETECT FAILED", e)
+        finally:
+            self._detecting = False
+
+    def add_frame(self, frame: np.ndarray) -> bool:
+        """Returns True when frame was added as a new view"""
+        grey = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.size = grey.shape[1], grey.shape[0]
+        self.corners = find_chessboard(grey, self.pattern, self.detect_scale)
+        if self.corners is None:
+            return False
+        with self._lock:
+            if self._is_duplicate(self.corners):
+                self.duplicates += 1
+                return False
+            self.views.append(self.corners)
+        self._submit()
+        return True
+
+    def _submit(self):
+        with self._lock:
+            if self._closed or self._solving or len(self.views) < self.min_views:
+                return
+            if len(self.views) == self._solved_views:
+                return
+            self._solving = True
+            views = list(self.views)
+            try:
+                future = self._executor.submit(
+                    solve_calibration,
+                    [self.object_points] * len(views),
+                    views,
+                    self.size,
+                )
+            except RuntimeError:
+                # the pool is shut down
+                self._solving = False
+                return
+        future.add_done_callback(lambda f: self._solved(f, len(views)))
+
+    def _solved(self, future, views: int):
+        result = None
+        if not future.cancelled():
+            try:
+                result = future.result()
+            except Exception as e:
+                print("CALIBRATION FAILED", e)
+        with self._lock:
+            self._solving = False
+            if result is not None:
+                self.result = result
+                self.rms = result[0]
+                self._solved_views = views
+            closed = self._closed
+        if closed:
+            self._finish()
+        else:
+            # views added while solving
+            self._submit()
+
+    def draw(self, img: np.ndarray) -> np.ndarray:
+        if self.corners is not None:
+            cv2.drawChessboardCorners(img, self.pattern, self.corners, True)
+        rms = "-" if self.rms is None else f"{self.rms:.3f}px"
+        cv2.putText(
+            img,
+            f"CALIBRATION views {len(self.views)} rms {rms}",
+            (10, 60),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            1,
+            (0, 255, 255),
+            2,
+        )
+        return img
+
+    def calibration(self) -> typing.Optional[Calibration]:
+        if self.result is None:
+            return None
+        _, mtx, dist, newmtx, roi = self.result
+        return Calibration(mtx, dist, newmtx, roi)
+
+    def save(self, path) -> bool:
+        """Writes the keys load_calibration reads"""
+        if self.result is None:
+            return False
+        _, mtx, dist, newmtx, roi = self.result
+        np.savez(path, mtx=mtx, dist=dist, newmtx=newmtx, roi=roi)
+        return True
+
+    def close(self, on_done: typing.Callable[["CalibrationSession"], None] = None):
+        """
+        Stops taking frames without waiting for a running solve. on_done(self)
+        is called once its result is in, from the pool's thread, or right
+        away when nothing is being solved.
+        """
+        with self._lock:
+            self._closed = True
+            self._on_done = on_done
+            solving = self._solving
+        self._detector.shutdown(wait=False, cancel_futures=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if not solving:
+            self._finish()
+
+    def _finish(self):
+        on_done, self._on_done = self._on_done, None
+        if on_done is not None:
+            on_done(self)
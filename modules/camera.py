@@ -1,15 +1,16 @@
-from urllib.request import urlopen
-
 import cv2
 import numpy as np
-import requests
-from imutils.video import WebcamVideoStream
 import subprocess
 
+from modules.frames import FrameSlot
+
+# the source modules (imutils, http, requests) are imported by the branch
+# that needs them, a still image starts without any of them
+
 
 class Droidcam(object):
     """
-    Facade for webcam or still image
+    Facade for webcam, IP camera, still image or a replayed recording
     """
 
     #TODO: remove droidcam stuff
@@ -17,19 +18,47 @@ class Droidcam(object):
     def __init__(
         self,
         ip="192.168.10.241",
+        port=8080,
         use_webcam=True,
         webcam_index=0,
         img_src=None,
         exposure=30,
         setup=False,
+        stream=False,
+        stream_path="/video",
+        replay_src=None,
+        replay_realtime=False,
+        replay_loop=False,
     ):
-        self.address = "http://%s:8080" % ip
-        self.use_webcam = use_webcam
+        self.address = "http://%s:%d" % (ip, port)
+        self.use_webcam = use_webcam and not replay_src
         self.img = None
         self.setup = setup
+        # v4l2 exposure_absolute, 100 us units
+        self.exposure = exposure
+        self.slot = FrameSlot()
+        self._last_read_id = 0
+        self._pull = False
+        self.ms = None
+        self.rs = None
+
+        if replay_src:
+            from modules.recording import ReplayStream
+
+            self.rs = ReplayStream(
+                replay_src, realtime=replay_realtime, loop=replay_loop
+            )
+            self.rs.start()
+            self.slot = self.rs.slot
+            # without realtime pacing every read_new steps to the next frame
+            self._pull = not replay_realtime
+
+            def _read():
+                return self.rs.read()
 
-        if img_src:
+        elif img_src:
             self.img = cv2.imread(img_src, 1)
+            self.slot.publish(self.img)
 
             def _read():
                 return self.img
@@ -58,19 +87,37 @@ class Droidcam(object):
                 # grabMode = self.vs.stream.get(cv2.CAP_PROP_PVAPI_PIXELFORMAT)
                 # print(grabMode)
                 # result_set = self.vs.stream.set(cv2.CAP_, 1)
-                self.vs = WebcamVideoStream(src=webcam_index)
+                from modules.streams import SequencedVideoStream
+
+                self.vs = SequencedVideoStream(src=webcam_index)
                 self.vs.start()
+                self.slot = self.vs.slot
 
                 def _read():
                     return self.vs.read()
 
+            elif stream:
+                from modules.mjpeg import MjpegStream
+
+                self.ms = MjpegStream(self.address + stream_path)
+                self.ms.start()
+                self.slot = self.ms.slot
+                self.slot.wait_newer(0, self.ms.timeout)
+
+                def _read():
+                    return self.ms.read()
+
             else:
+                from urllib.request import urlopen
+
+                self._pull = True
 
                 def _read():
                     frame = urlopen("%s/shot.jpg" % self.address)
                     image = cv2.imdecode(
                         np.array(bytearray(frame.read()), dtype=np.uint8), -1
                     )
+                    self.slot.publish(image)
                     return image
 
         self._read = _read
@@ -81,25 +128,60 @@ class Droidcam(object):
         print("CAM DEAD")
         if self.use_webcam:
             self.vs.stop()
+        if self.ms is not None:
+            self.ms.stop()
+        if self.rs is not None:
+            self.rs.stop()
 
     def check(self):
+        import requests
+
         req = requests.get(self.address)
         return req.status_code
 
     def send_settings(self):
+        import requests
+
         param_size = "settings/video_size?set=960x720"
         param_quality = "settings/quality?set=50"
         resp_size = requests.get("%s/%s" % (self.address, param_size))
         resp_quality = requests.get("%s/%s" % (self.address, param_quality))
 
     def set_flashligth(self, enable=True):
+        import requests
+
         param = "enabletorch" if enable else "disabletorch"
         responce = requests.get("%s/%s" % (self.address, param))
         return responce.status_code
 
+    @property
+    def frame_id(self) -> int:
+        return self.slot.frame_id
+
+    @property
+    def frame_time(self) -> float:
+        return self.slot.frame_time
+
     def read(self):
         return self._read()
 
+    def read_new(self, timeout=None):
+        """
+        Returns a frame not yet returned by read_new, waiting up to timeout
+        seconds for the camera to deliver one, or None
+        """
+        if self.rs is not None:
+            if self._pull and self._last_read_id == self.slot.frame_id:
+                self.rs.step()
+        elif self._pull:
+            # IP camera shots are pulled, every fetch is a new frame
+            self._read()
+        latest = self.slot.wait_newer(self._last_read_id, timeout)
+        if latest is None:
+            return None
+        frame, self._last_read_id, _ = latest
+        return frame
+
     def read_resize(self, width=300):
         frame = self._read()
         sheight, swidth = frame.shape[:2]
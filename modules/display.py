@@ -0,0 +1,148 @@
+import typing
+
+import cv2
+import numpy as np
+
+from modules.utils import mk_trakbar
+
+DISPLAY_OPENCV = "opencv"
+DISPLAY_DEARPYGUI = "dearpygui"
+# returned by poll_key when the user closed the window
+QUIT_KEY = ord("q")
+
+
+class OpenCVDisplay:
+    """HighGUI window, settings as trackbars"""
+
+    def __init__(self, window_name: str):
+        self.window_name = window_name
+
+    def open(self, settings: dict, limits: typing.Dict[str, int]):
+        cv2.namedWindow(self.window_name)
+        for key, maxv in limits.items():
+            mk_trakbar(self.window_name, settings, key, maxv)
+
+    def show(self, frame: np.ndarray):
+        cv2.imshow(self.window_name, frame)
+
+    def set_title(self, title: str):
+        cv2.setWindowTitle(self.window_name, title)
+
+    def poll_key(self) -> int:
+        return cv2.waitKey(1)
+
+    def close(self):
+        cv2.destroyAllWindows()
+
+
+class DearPyGuiDisplay:
+    """
+    dearpygui viewport, settings as native sliders. Frames are converted
+    with cv2.cvtColor into a preallocated RGBA buffer; dearpygui 1.6 raw
+    textures only take float32, so that is scaled into a second
+    preallocated buffer the texture reads from. Nothing is allocated per
+    frame. Must be driven from one thread, like HighGUI.
+    """
+
+    def __init__(self, window_name: str):
+        # optional dependency, only needed with this backend
+        import dearpygui.dearpygui as dpg
+
+        self._dpg = dpg
+        self.window_name = window_name
+        self._rgba = None
+        self._texture_data = None
+        self._texture = None
+        self._image = None
+        self._keys = []
+        self._open = False
+
+    def open(self, settings: dict, limits: typing.Dict[str, int]):
+        dpg = self._dpg
+        dpg.create_context()
+        # slider and key callbacks run in poll_key, on the display thread
+        dpg.configure_app(manual_callback_management=True)
+        dpg.create_viewport(title=self.window_name, width=1280, height=900)
+        dpg.setup_dearpygui()
+        with dpg.handler_registry():
+            dpg.add_key_press_handler(callback=self._on_key)
+        with dpg.window(tag="main") as self._window:
+            for key, maxv in limits.items():
+                dpg.add_slider_int(
+                    label=key,
+                    default_value=settings.get(key, 0),
+                    min_value=0,
+                    max_value=maxv,
+                    width=400,
+                    callback=lambda sender, value, key: settings.__setitem__(key, value),
+                    user_data=key,
+                )
+        dpg.set_primary_window("main", True)
+        dpg.show_viewport()
+        self._open = True
+
+    def _on_key(self, sender, key):
+        # dearpygui key codes are the upper case ASCII of letters
+        self._keys.append(key + 32 if ord("A") <= key <= ord("Z") else key)
+
+    def _texture_for(self, shape: tuple):
+        height, width = shape[:2]
+        if self._rgba is not None and self._rgba.shape[:2] == (height, width):
+            return
+        dpg = self._dpg
+        self._rgba = np.empty((height, width, 4), dtype=np.uint8)
+        self._texture_data = np.zeros(height * width * 4, dtype=np.float32)
+        with dpg.texture_registry():
+            self._texture = dpg.add_raw_texture(
+                width, height, self._texture_data, format=dpg.mvFormat_Float_rgba
+            )
+        # a texture of the old size is left to destroy_context, the frame
+        # size only changes with the source
+        if self._image is None:
+            self._image = dpg.add_image(self._texture, parent=self._window)
+        else:
+            dpg.configure_item(
+                self._image, texture_tag=self._texture, width=width, height=height
+            )
+
+    def show(self, frame: np.ndarray):
+        if not self._open:
+            return
+        self._texture_for(frame.shape)
+        code = cv2.COLOR_GRAY2RGBA if frame.ndim == 2 else cv2.COLOR_BGR2RGBA
+        cv2.cvtColor(frame, code, dst=self._rgba)
+        np.multiply(
+            self._rgba.reshape(-1), np.float32(1 / 255), out=self._texture_data
+        )
+        self._dpg.set_value(self._texture, self._texture_data)
+        self._dpg.render_dearpygui_frame()
+
+    def set_title(self, title: str):
+        if self._open:
+            self._dpg.set_viewport_title(title)
+
+    def poll_key(self) -> int:
+        if not self._open:
+            return -1
+        dpg = self._dpg
+        if not dpg.is_dearpygui_running():
+            return QUIT_KEY
+        if self._rgba is None:
+            # no frame shown yet, keep the viewport responsive
+            dpg.render_dearpygui_frame()
+        dpg.run_callbacks(dpg.get_callback_queue())
+        return self._keys.pop(0) if self._keys else -1
+
+    def close(self):
+        if self._open:
+            self._open = False
+            self._dpg.destroy_context()
+
+
+DISPLAYS = {DISPLAY_OPENCV: OpenCVDisplay, DISPLAY_DEARPYGUI: DearPyGuiDisplay}
+
+
+def make_display(name: str, window_name: str):
+    if name not in DISPLAYS:
+        raise ValueError(f"unknown display {name}, one of {', '.join(DISPLAYS)}")
+    return DISPLAYS[name](window_name)
@@ -0,0 +1,324 @@
+import time
+import typing
+from concurrent.futures import Future
+
+import numpy as np
+
+from machine.grbl import GRBL
+
+# improvements smaller than this (mm) are rounding noise
+MIN_GAIN = 1e-6
+OR_OPT_SEGMENTS = (1, 2, 3)
+# Or-opt only tries inserting a run next to the nearest holes of its ends
+NEIGHBOURS = 8
+
+
+def size_classes(
+    sizes: np.ndarray, size_min: float, size_max: float, classes: int = 3
+) -> np.ndarray:
+    """
+    Class 0..classes-1 of every hole, from equal bins between the hole size
+    filter limits (HOLE_SIZE_MIN_KEY/HOLE_SIZE_MAX_KEY, blob areas in px)
+    """
+    edges = np.linspace(size_min, size_max, classes + 1)[1:-1]
+    return np.searchsorted(edges, np.asarray(sizes, dtype=np.float64), side="right")
+
+
+def travel_length(points: np.ndarray, route: np.ndarray, start=(0.0, 0.0)) -> float:
+    """Length of the open path from start through points in route order"""
+    path = np.vstack((np.asarray(start, dtype=np.float64), points[route]))
+    return float(np.hypot(*np.diff(path, axis=0).T).sum())
+
+
+def nearest_neighbour(points: np.ndarray, start=(0.0, 0.0)) -> np.ndarray:
+    """Greedy route: always the closest hole not drilled yet"""
+    n = len(points)
+    route = np.empty(n, dtype=int)
+    x, y = points[:, 0].copy(), points[:, 1].copy()
+    current = np.asarray(start, dtype=np.float64)
+    for k in range(n):
+        nearest = int(np.argmin((x - current[0]) ** 2 + (y - current[1]) ** 2))
+        route[k] = nearest
+        current = points[nearest]
+        # visited holes move out of reach instead of being removed
+        x[nearest] = y[nearest] = np.inf
+    return route
+
+
+def nearest_neighbours(
+    points: np.ndarray, k: int = NEIGHBOURS, chunk: int = 512
+) -> np.ndarray:
+    """(N, k) indices of the k closest other points, in blocks of chunk rows"""
+    k = min(k, len(points) - 1)
+    result = np.empty((len(points), k), dtype=int)
+    squared = (points**2).sum(axis=1)
+    for begin in range(0, len(points), chunk):
+        block = points[begin : begin + chunk]
+        distances = squared[begin : begin + chunk, None] + squared - 2 * block @ points.T
+        distances[np.arange(len(block)), np.arange(begin, begin + len(block))] = np.inf
+        result[begin : begin + chunk] = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    return result
+
+
+class _Path:
+    """
+    Open path start -> points[route] as coordinate arrays; node 0 is the
+    fixed start, node k is route[k - 1]. edges[k] is the length of k -> k+1,
+    node[p] the node of point p.
+    """
+
+    def __init__(self, points: np.ndarray, route: np.ndarray, start):
+        self.points = points
+        self.start = np.asarray(start, dtype=np.float64)
+        self.set_route(route)
+
+    def set_route(self, route: np.ndarray):
+        self.route = route
+        nodes = np.vstack((self.start, self.points[route]))
+        self.x = nodes[:, 0].copy()
+        self.y = nodes[:, 1].copy()
+        self.edges = np.hypot(np.diff(self.x), np.diff(self.y))
+        self.node = np.empty(len(route), dtype=int)
+        self.node[route] = np.arange(1, len(route) + 1)
+
+    def dist(self, a: int, b) -> np.ndarray:
+        return np.hypot(self.x[b] - self.x[a], self.y[b] - self.y[a])
+
+    def reverse(self, i: int, j: int):
+        """Reverses nodes i..j in place, updating the edges touching them"""
+        self.route[i - 1 : j] = self.route[i - 1 : j][::-1]
+        self.node[self.route[i - 1 : j]] = np.arange(i, j + 1)
+        self.x[i : j + 1] = self.x[i : j + 1][::-1]
+        self.y[i : j + 1] = self.y[i : j + 1][::-1]
+        self.edges[i:j] = self.edges[i:j][::-1]
+        self.edges[i - 1] = self.dist(i - 1, i)
+        if j < len(self.edges):
+            self.edges[j] = self.dist(j, j + 1)
+
+
+def _two_opt_pass(path: _Path, deadline: float) -> bool:
+    """
+    For every edge i -> i+1 the best reversal of nodes i+1..j over all j at
+    once; the last node has no outgoing edge, reversing up to it only swaps
+    one edge.
+    """
+    n = len(path.edges)
+    improved = False
+    i = 0
+    while i < n - 1:
+        if time.monotonic() > deadline:
+            break
+        x, y, edges = path.x, path.y, path.edges
+        # j = i+2 .. n-1, replacing edges i and j by (i, j) and (i+1, j+1)
+        delta = (
+            np.hypot(x[i + 2 : n] - x[i], y[i + 2 : n] - y[i])
+            + np.hypot(x[i + 3 : n + 1] - x[i + 1], y[i + 3 : n + 1] - y[i + 1])
+            - edges[i]
+            - edges[i + 2 : n]
+        )
+        end_delta = path.dist(i, n) - edges[i]
+        best = int(np.argmin(delta)) if len(delta) else -1
+        if best >= 0 and delta[best] < min(end_delta, -MIN_GAIN):
+            path.reverse(i + 1, best + i + 2)
+        elif end_delta < -MIN_GAIN:
+            path.reverse(i + 1, n)
+        else:
+            i += 1
+            continue
+        improved = True
+    return improved
+
+
+def _or_opt_pass(path: _Path, neighbours: np.ndarray, deadline: float) -> bool:
+    """
+    Moves runs of 1-3 consecutive holes, either way round, to the edge
+    where inserting them costs least. Only edges touching a neighbour of
+    either end of the run are priced, all of them at once.
+    """
+    improved = False
+    for length in OR_OPT_SEGMENTS:
+        i = 1
+        while i + length - 1 <= len(path.edges):
+            if time.monotonic() > deadline:
+                return improved
+            n = len(path.edges)
+            x, y, edges = path.x, path.y, path.edges
+            first, last, prev, after = i, i + length - 1, i - 1, i + length
+            if after <= n:
+                removed = edges[prev] + edges[last] - path.dist(prev, after)
+            else:
+                removed = edges[prev]
+            # insert between k and k+1, or after the last node
+            near = path.node[neighbours[path.route[[first - 1, last - 1]]].ravel()]
+            ks = np.concatenate((near - 1, near))
+            # not next to the run itself
+            ks = ks[(ks < prev) | ((ks > last) & (ks < n))]
+            cost, reverse, k = np.inf, False, -1
+            if len(ks):
+                head = np.hypot(x[ks] - x[first], y[ks] - y[first])
+                tail = np.hypot(x[ks + 1] - x[last], y[ks + 1] - y[last])
+                head_rev = np.hypot(x[ks] - x[last], y[ks] - y[last])
+                tail_rev = np.hypot(x[ks + 1] - x[first], y[ks + 1] - y[first])
+                forward = head + tail - edges[ks]
+                backward = head_rev + tail_rev - edges[ks]
+                costs = np.minimum(forward, backward)
+                best = int(np.argmin(costs))
+                k, cost = int(ks[best]), costs[best]
+                reverse = backward[best] < forward[best]
+            if after <= n:
+                end_forward, end_backward = path.dist(n, first), path.dist(n, last)
+                if min(end_forward, end_backward) < cost:
+                    k, cost = n, min(end_forward, end_backward)
+                    reverse = end_backward < end_forward
+            if removed - cost > MIN_GAIN:
+                run = path.route[first - 1 : last]
+                if reverse:
+                    run = run[::-1]
+                rest = np.concatenate((path.route[: first - 1], path.route[last:]))
+                # node k sits at rest position k - 1 if before the run
+                at = k if k < first else k - length
+                path.set_route(np.concatenate((rest[:at], run, rest[at:])))
+                improved = True
+            else:
+                i += 1
+    return improved
+
+
+def optimise_route(
+    points: np.ndarray,
+    route: np.ndarray,
+    start=(0.0, 0.0),
+    deadline: float = None,
+) -> np.ndarray:
+    """
+    2-opt and Or-opt passes over route until neither improves it or the
+    deadline (time.monotonic()) passes
+    """
+    if deadline is None:
+        deadline = float("inf")
+    if len(route) < 3:
+        return route
+    path = _Path(points, route.copy(), start)
+    neighbours = nearest_neighbours(points)
+    while time.monotonic() < deadline:
+        improved = _two_opt_pass(path, deadline)
+        improved = _or_opt_pass(path, neighbours, deadline) or improved
+        if not improved:
+            break
+    return path.route
+
+
+class DrillJob:
+    """
+    Holes in drilling order, board (work) coordinates in mm. classes holds
+    the size class of every hole, non-decreasing, so each bit is used once.
+    """
+
+    def __init__(self, holes: np.ndarray, classes: np.ndarray, start=(0.0, 0.0)):
+        self.holes = holes
+        self.classes = classes
+        self.start = start
+
+    def __len__(self):
+        return len(self.holes)
+
+    @property
+    def travel(self) -> float:
+        return travel_length(self.holes, np.arange(len(self.holes)), self.start)
+
+    def gcode(
+        self,
+        spindle_speed: int,
+        depth: float = -2.0,
+        safe_z: float = 2.0,
+        plunge_feed: int = 100,
+        pause_between_classes: bool = True,
+    ) -> typing.List[str]:
+        """
+        GRBL has no canned drilling cycles, so every hole is a rapid move,
+        a straight plunge and a rapid retract. With pause_between_classes
+        the spindle stops and the program pauses (M0) for a bit change,
+        resumed by cycle start (GRBL.cycle_start).
+        """
+        if not spindle_speed or spindle_speed <= 0:
+            raise ValueError(f"spindle speed must be positive, got {spindle_speed}")
+        lines = ["G21", "G90", f"G0Z{safe_z:.3f}", f"M3S{spindle_speed}"]
+        current = None
+        for (x, y), size_class in zip(self.holes, self.classes):
+            if size_class != current:
+                if current is not None and pause_between_classes:
+                    lines += ["M5", "M0", f"M3S{spindle_speed}"]
+                lines.append(f"(size class {size_class})")
+                current = size_class
+            lines += [
+                f"G0X{x:.3f}Y{y:.3f}",
+                f"G1Z{depth:.3f}F{plunge_feed}",
+                f"G0Z{safe_z:.3f}",
+            ]
+        lines.append("M5")
+        return lines
+
+    def save(self, path: str, spindle_speed: int, **kwargs):
+        with open(path, "w") as f:
+            f.write("\n".join(self.gcode(spindle_speed, **kwargs)) + "\n")
+
+    def stream(
+        self, machine: GRBL, spindle_speed: int, on_ack=None, **kwargs
+    ) -> typing.List[Future]:
+        """
+        Streams the program through GRBL's character-counting protocol;
+        blocks until the last line is in the machine's receive buffer
+        """
+        return machine.stream(self.gcode(spindle_speed, **kwargs), on_ack)
+
+
+def plan_drill_job(
+    holes: np.ndarray,
+    sizes: np.ndarray = None,
+    size_range: typing.Sequence[float] = None,
+    classes: int = 3,
+    start=(0.0, 0.0),
+    time_budget: float = 0.8,
+) -> DrillJob:
+    """
+    Orders holes for drilling: grouped by size class (smallest first; with
+    sizes but no size_range one class per distinct size, e.g. the tool
+    diameters of a drill file; all one class without sizes), each group a
+    nearest neighbour route from where the previous one ended, improved by
+    2-opt/Or-opt within time_budget seconds shared by the groups in
+    proportion to their size.
+    """
+    holes = np.asarray(holes, dtype=np.float64).reshape(-1, 2)
+    if sizes is None:
+        labels = np.zeros(len(holes), dtype=int)
+    elif size_range is None:
+        _, labels = np.unique(sizes, return_inverse=True)
+    else:
+        labels = size_classes(sizes, size_range[0], size_range[1], classes)
+    started = time.monotonic()
+    routes = []
+    position = np.asarray(start, dtype=np.float64)
+    done = 0
+    for size_class in np.unique(labels):
+        members = np.flatnonzero(labels == size_class)
+        points = holes[members]
+        done += len(members)
+        deadline = started + time_budget * done / len(holes)
+        route = optimise_route(
+            points, nearest_neighbour(points, position), position, deadline
+        )
+        routes.append(members[route])
+        position = points[route[-1]]
+    order = np.concatenate(routes) if routes else np.zeros(0, dtype=int)
+    return DrillJob(holes[order], labels[order], start)
+
+
+def load_holes(path: str) -> (np.ndarray, typing.Optional[np.ndarray]):
+    """
+    Holes saved by a board scan, x,y[,size] per line; sizes is None
+    without the third column
+    """
+    data = np.loadtxt(path, delimiter=",", ndmin=2)
+    if data.shape[1] > 2:
+        return data[:, :2], data[:, 2]
+    return data[:, :2], None
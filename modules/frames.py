@@ -0,0 +1,39 @@
+import threading
+import time
+
+import numpy as np
+
+
+class FrameSlot:
+    """
+    Latest frame published by a capture thread, with a sequence number and
+    a time.monotonic() capture timestamp
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.frame = None
+        self.frame_id = 0
+        self.frame_time = None
+
+    def publish(self, frame: np.ndarray, frame_time: float = None) -> int:
+        with self._cond:
+            self.frame = frame
+            self.frame_id += 1
+            self.frame_time = time.monotonic() if frame_time is None else frame_time
+            self._cond.notify_all()
+            return self.frame_id
+
+    def latest(self) -> (np.ndarray, int, float):
+        with self._cond:
+            return self.frame, self.frame_id, self.frame_time
+
+    def wait_newer(self, frame_id: int, timeout: float = None):
+        """
+        Blocks until a frame newer than frame_id is published, returns
+        (frame, frame_id, frame_time) or None on timeout
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.frame_id > frame_id, timeout):
+                return None
+            return self.frame, self.frame_id, self.frame_time
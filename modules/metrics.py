@@ -0,0 +1,240 @@
+import json
+import threading
+import time
+import typing
+
+import cv2
+import numpy as np
+
+QUANTILES = (0.5, 0.9, 0.99)
+# histogram bucket upper bounds in seconds, for the JSON export
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+
+class RingTimer:
+    """
+    Last size durations of one stage, in seconds. add() only stores into a
+    preallocated list; statistics are computed when asked for.
+    """
+
+    __slots__ = ("_values", "_size", "count", "total")
+
+    def __init__(self, size: int = 1024):
+        self._values = [0.0] * size
+        self._size = size
+        # over the whole run, for Prometheus counters
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds: float):
+        self._values[self.count % self._size] = seconds
+        self.count += 1
+        self.total += seconds
+
+    def values(self) -> np.ndarray:
+        return np.array(self._values[: min(self.count, self._size)])
+
+    def summary(self) -> dict:
+        values = self.values()
+        if not len(values):
+            return {"count": 0}
+        quantiles = np.quantile(values, QUANTILES)
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": float(values.mean()),
+            "max": float(values.max()),
+            "quantiles": {str(q): float(v) for q, v in zip(QUANTILES, quantiles)},
+            "histogram": {
+                str(bound): int(n)
+                for bound, n in zip(
+                    BUCKETS, np.searchsorted(np.sort(values), BUCKETS, side="right")
+                )
+            },
+        }
+
+
+class _Span:
+    __slots__ = ("_timer", "_started")
+
+    def __init__(self, timer: RingTimer):
+        self._timer = timer
+        self._started = 0.0
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._timer.add(time.perf_counter() - self._started)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Metrics:
+    """
+    Named stage timers. stage(name) is a reusable context manager, one per
+    name, so timing a stage allocates nothing; a stage must only be timed
+    from one thread. Disabled metrics hand out a no-op span.
+    """
+
+    def __init__(self, enabled: bool = True, size: int = 1024):
+        self.enabled = enabled
+        self.size = size
+        self.timers: typing.Dict[str, RingTimer] = {}
+        self._spans = {}
+        self.started_at = time.monotonic()
+
+    def timer(self, name: str) -> RingTimer:
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = RingTimer(self.size)
+            self._spans[name] = _Span(timer)
+        return timer
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return NULL_SPAN
+        span = self._spans.get(name)
+        if span is None:
+            self.timer(name)
+            span = self._spans[name]
+        return span
+
+    def add(self, name: str, seconds: float):
+        if self.enabled:
+            self.timer(name).add(seconds)
+
+    def on_machine_event(self, event: str, payload):
+        # GRBL.subscribe callback, '?' polls and G-code lines apart
+        if event == "roundtrip":
+            command, seconds = payload
+            self.add("grbl_status" if command == "?" else "grbl_command", seconds)
+
+    def snapshot(self) -> dict:
+        return {
+            "uptime": time.monotonic() - self.started_at,
+            "stages": {
+                name: timer.summary() for name, timer in list(self.timers.items())
+            },
+        }
+
+    def prometheus(self, prefix: str = "board_scanner") -> str:
+        name = f"{prefix}_stage_seconds"
+        lines = [
+            f"# HELP {name} Stage durations, quantiles over the last "
+            f"{self.size} samples",
+            f"# TYPE {name} summary",
+        ]
+        for stage, summary in self.snapshot()["stages"].items():
+            if not summary["count"]:
+                continue
+            for q, value in summary["quantiles"].items():
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {value:.6g}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {summary["sum"]:.6g}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {summary["count"]}')
+        return "\n".join(lines) + "\n"
+
+
+class Hud:
+    """
+    Overlay with the p50/p99 of every stage. The text is only recomputed
+    every refresh frames, drawing it costs a few putText calls.
+    """
+
+    def __init__(self, metrics: Metrics, refresh: int = 15, origin=(10, 90)):
+        self.metrics = metrics
+        self.refresh = refresh
+        self.origin = origin
+        self.visible = True
+        self._lines = []
+        self._frames = 0
+
+    def _update(self):
+        lines = []
+        for name, timer in list(self.metrics.timers.items()):
+            values = timer.values()
+            if len(values):
+                p50, p99 = np.quantile(values, (0.5, 0.99)) * 1000
+                lines.append(f"{name:<13}{p50:6.1f} {p99:6.1f} ms")
+        self._lines = lines
+
+    def draw(self, img: np.ndarray) -> np.ndarray:
+        if not self.visible:
+            return img
+        if self._frames % self.refresh == 0:
+            self._update()
+        self._frames += 1
+        x, y = self.origin
+        for i, line in enumerate(self._lines):
+            cv2.putText(
+                img,
+                line,
+                (x, y + i * 22),
+                cv2.FONT_HERSHEY_PLAIN,
+                1.2,
+                (255, 255, 0),
+                1,
+            )
+        return img
+
+
+class MetricsServer:
+    """
+    Serves /metrics (Prometheus text) and /metrics.json on a local port from
+    a daemon thread; snapshots are taken when scraped.
+    """
+
+    def __init__(self, metrics: Metrics, port: int = 9108, host: str = "127.0.0.1"):
+        # only needed when exporting, keeps http.server off the startup path
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.metrics = metrics
+        self.host = host
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path == "/metrics":
+                    body = metrics.prometheus().encode()
+                    content_type = "text/plain; version=0.0.4"
+                elif handler.path == "/metrics.json":
+                    body = json.dumps(metrics.snapshot()).encode()
+                    content_type = "application/json"
+                else:
+                    handler.send_error(404)
+                    return
+                handler.send_response(200)
+                handler.send_header("Content-Type", content_type)
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="MetricsServer", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        print(f"METRICS on http://{self.host}:{self.port}/metrics")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,121 @@
+import http.client
+import threading
+import time
+import urllib.parse
+
+import cv2
+import numpy as np
+
+from modules.frames import FrameSlot
+
+SOI = b"\xff\xd8"
+EOI = b"\xff\xd9"
+
+
+def find_last_jpeg(buf: bytearray, start: int = 0) -> (int, int):
+    """
+    Returns (begin, end) of the last complete JPEG in buf, looking for its end
+    marker from start on, or (-1, start) when there is none yet. Earlier
+    complete JPEGs are stale and get skipped.
+    """
+    end = buf.rfind(EOI, start)
+    if end == -1:
+        return -1, start
+    end += len(EOI)
+    begin = buf.rfind(SOI, 0, end - len(EOI))
+    return begin, end
+
+
+class MjpegStream:
+    """
+    Keep-alive MJPEG client: holds one HTTP connection to a
+    multipart/x-mixed-replace endpoint, cuts JPEGs out of one growing buffer
+    and decodes the newest one on its own thread into a FrameSlot
+    """
+
+    def __init__(
+        self,
+        url: str,
+        chunk_size: int = 64 * 1024,
+        timeout: float = 5.0,
+        reconnect_delay: float = 1.0,
+        name: str = "MjpegStream",
+    ):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path or "/"
+        if parsed.query:
+            self.path += "?" + parsed.query
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self.name = name
+        self.slot = FrameSlot()
+        self.stopped = False
+        self.connections = 0
+        self._conn = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.update, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def _connect(self) -> http.client.HTTPResponse:
+        self._conn = http.client.HTTPConnection(
+            self.host, self.port, timeout=self.timeout
+        )
+        self._conn.request("GET", self.path, headers={"Connection": "keep-alive"})
+        response = self._conn.getresponse()
+        if response.status != 200:
+            raise ConnectionError(f"{self.path}: HTTP {response.status}")
+        self.connections += 1
+        return response
+
+    def _consume(self, response: http.client.HTTPResponse) -> None:
+        buf = bytearray()
+        while not self.stopped:
+            chunk = response.read1(self.chunk_size)
+            if not chunk:
+                raise ConnectionError("stream closed")
+            # only the tail can complete a JPEG, don't rescan older bytes
+            scan_from = max(len(buf) - len(EOI) + 1, 0)
+            buf += chunk
+            begin, end = find_last_jpeg(buf, scan_from)
+            if begin == -1:
+                if end > scan_from:
+                    # end of a JPEG whose start was already dropped
+                    del buf[:end]
+                continue
+            frame = cv2.imdecode(
+                np.frombuffer(buf, dtype=np.uint8, count=end - begin, offset=begin),
+                cv2.IMREAD_COLOR,
+            )
+            del buf[:end]
+            if frame is not None:
+                self.slot.publish(frame)
+
+    def update(self):
+        while not self.stopped:
+            try:
+                self._consume(self._connect())
+            except (OSError, http.client.HTTPException) as e:
+                if self.stopped:
+                    return
+                print("MJPEG", e)
+                time.sleep(self.reconnect_delay)
+            finally:
+                self._close()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def read(self) -> np.ndarray:
+        return self.slot.frame
+
+    def stop(self):
+        self.stopped = True
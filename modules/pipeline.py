@@ -0,0 +1,109 @@
+import collections
+import threading
+import time
+import typing
+
+
+class DropOldestQueue:
+    """
+    Bounded hand-off between pipeline stages.
+
+    put never blocks: when the queue is full the oldest item is dropped, so a
+    slow consumer always gets the most recent frame. Items are passed by
+    reference, frames are not copied.
+    """
+
+    def __init__(self, maxsize: int = 1):
+        self._items = collections.deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item) -> None:
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout: float = None):
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class FramePacket:
+    __slots__ = ("frame", "captured_at", "centers", "processed_at")
+
+    def __init__(self, frame, captured_at: float):
+        self.frame = frame
+        self.captured_at = captured_at
+        self.centers = []
+        self.processed_at = None
+
+    @property
+    def latency(self) -> float:
+        return self.processed_at - self.captured_at
+
+
+class LatencyMeter:
+    """
+    Rolling camera-to-detection latency, in seconds
+    """
+
+    def __init__(self, size: int = 120):
+        self._samples = collections.deque(maxlen=size)
+
+    def add(self, value: float) -> None:
+        self._samples.append(value)
+
+    @property
+    def mean(self) -> float:
+        if not self._samples:
+            return 0.0
+        return sum(self._samples) / len(self._samples)
+
+    @property
+    def max(self) -> float:
+        return max(self._samples, default=0.0)
+
+    def __str__(self):
+        return f"latency {self.mean * 1000:.1f}ms (max {self.max * 1000:.1f}ms)"
+
+
+class Stage(threading.Thread):
+    """
+    Runs step() in a loop on its own daemon thread until is_running() is false.
+    A step that raises is logged and skipped, one bad frame must not end the
+    stage while the display keeps waiting for it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        step: typing.Callable[[], None],
+        is_running: typing.Callable[[], bool],
+    ):
+        super().__init__(name=name, daemon=True)
+        self._step = step
+        self._is_running = is_running
+        self.errors = 0
+
+    def run(self):
+        while self._is_running():
+            try:
+                self._step()
+            except Exception as e:
+                self.errors += 1
+                print(f"{self.name.upper()} FAILED", repr(e))
+
+
+def sleep_until(deadline: float) -> None:
+    delay = deadline - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
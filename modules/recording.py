@@ -0,0 +1,209 @@
+import json
+import queue
+import struct
+import threading
+import time
+import typing
+
+import numpy as np
+
+from modules.frames import FrameSlot
+
+MAGIC = b"BSREC\x00\x01\x00"
+# header is padded so the first record starts at a page-friendly offset
+HEADER_ALIGN = 64
+META_FIELDS = ("t", "x", "y", "z")
+
+
+def record_dtype(shape: tuple, dtype) -> np.dtype:
+    """One record: capture time, machine position and the raw frame"""
+    return np.dtype(
+        [(name, "<f8") for name in META_FIELDS] + [("frame", np.dtype(dtype), shape)]
+    )
+
+
+def _header(shape: tuple, dtype) -> bytes:
+    info = json.dumps({"shape": list(shape), "dtype": np.dtype(dtype).str}).encode()
+    size = len(MAGIC) + 4 + len(info)
+    padding = -size % HEADER_ALIGN
+    return MAGIC + struct.pack("<I", len(info) + padding) + info + b" " * padding
+
+
+class FrameRecorder:
+    """
+    Appends frames with their capture time (time.monotonic()) and machine
+    position to a raw recording file. Frames are queued to a writer thread
+    and written chunk_frames records at a time; when the disk cannot keep
+    up frames are dropped (and counted) instead of stalling the capture.
+    All frames of a recording must have the same shape and dtype.
+    """
+
+    def __init__(self, path: str, chunk_frames: int = 16, max_queued: int = 64):
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._dtype = None
+        self._thread = threading.Thread(
+            target=self._write_loop, name="FrameRecorder", daemon=True
+        )
+        self._file = open(path, "wb")
+        self._thread.start()
+
+    def write(self, frame: np.ndarray, frame_time: float = None, position=None):
+        if frame_time is None:
+            frame_time = time.monotonic()
+        x, y, z = position[:3] if position is not None else (np.nan,) * 3
+        try:
+            self._queue.put_nowait((frame, frame_time, x, y, z))
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_chunk(self, items):
+        if self._dtype is None:
+            shape, dtype = items[0][0].shape, items[0][0].dtype
+            self._dtype = record_dtype(shape, dtype)
+            self._file.write(_header(shape, dtype))
+        chunk = np.empty(len(items), dtype=self._dtype)
+        for record, (frame, *meta) in zip(chunk, items):
+            if frame.shape != self._dtype["frame"].shape:
+                raise ValueError(f"frame shape {frame.shape} changed during recording")
+            record["t"], record["x"], record["y"], record["z"] = meta
+            record["frame"] = frame
+        self._file.write(chunk.tobytes())
+        self.written += len(items)
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            items = []
+            while item is not None:
+                items.append(item)
+                if len(items) == self.chunk_frames:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if items:
+                try:
+                    self._write_chunk(items)
+                except Exception as e:
+                    print("RECORDING FAILED", e)
+                    self.dropped += len(items)
+            if item is None:
+                self._file.close()
+                return
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        print(f"REC {self.written} frames to {self.path}, {self.dropped} dropped")
+
+
+class Recording:
+    """
+    Read-only, memory-mapped view of a FrameRecorder file. frames, times and
+    positions are views into the file, nothing is copied until used; a
+    record cut short by a crash at the end is ignored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a frame recording")
+            (size,) = struct.unpack("<I", f.read(4))
+            info = json.loads(f.read(size))
+        self.shape = tuple(info["shape"])
+        self.dtype = np.dtype(info["dtype"])
+        offset = len(MAGIC) + 4 + size
+        records = np.memmap(path, dtype=np.uint8, mode="r", offset=offset)
+        record = record_dtype(self.shape, self.dtype)
+        count = len(records) // record.itemsize
+        self.records = records[: count * record.itemsize].view(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def frames(self) -> np.ndarray:
+        return self.records["frame"]
+
+    @property
+    def times(self) -> np.ndarray:
+        return self.records["t"]
+
+    @property
+    def positions(self) -> np.ndarray:
+        """(N, 3) machine X, Y, Z at capture time"""
+        return np.column_stack([self.records[name] for name in META_FIELDS[1:]])
+
+
+class ReplayStream:
+    """
+    Serves a Recording through a FrameSlot like the live streams do. With
+    realtime the frames are published on a thread at their recorded pace,
+    otherwise step() publishes the next frame, so every frame is processed
+    exactly once however slow the consumer is.
+    """
+
+    def __init__(self, path: str, realtime: bool = False, loop: bool = False):
+        self.recording = Recording(path)
+        if not len(self.recording):
+            raise ValueError(f"{path} has no frames")
+        self.realtime = realtime
+        self.loop = loop
+        self.slot = FrameSlot()
+        self.index = -1
+        self.stopped = False
+        self._thread = None
+
+    @property
+    def position(self) -> np.ndarray:
+        """Recorded machine position of the current frame"""
+        record = self.recording.records[max(self.index, 0)]
+        # one record's fields, not a column_stack over the whole file
+        return np.array([record[name] for name in META_FIELDS[1:]])
+
+    def step(self) -> typing.Optional[np.ndarray]:
+        index = self.index + 1
+        if index >= len(self.recording):
+            if not self.loop:
+                return None
+            index = 0
+        self.index = index
+        frame = self.recording.frames[index]
+        self.slot.publish(frame)
+        return frame
+
+    def start(self):
+        self.step()
+        if self.realtime:
+            self._thread = threading.Thread(
+                target=self.update, name="ReplayStream", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def update(self):
+        times = self.recording.times
+        started = time.monotonic() - (times[self.index] - times[0])
+        while not self.stopped:
+            index = self.index + 1
+            if index >= len(times):
+                if not self.loop:
+                    return
+                started = time.monotonic()
+                index = 0
+            delay = started + (times[index] - times[0]) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.step()
+
+    def read(self) -> np.ndarray:
+        return self.recording.frames[max(self.index, 0)]
+
+    def stop(self):
+        self.stopped = True
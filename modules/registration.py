@@ -0,0 +1,354 @@
+import re
+import typing
+
+import cv2
+import numpy as np
+
+# cv2.flann_Index algorithms: 4 is a single exact KD-tree (KDTreeSingleIndex)
+FLANN_KDTREE_SINGLE = 4
+# excellon integer/decimal digits when the file doesn't say
+EXCELLON_DIGITS = {"METRIC": (3, 3), "INCH": (2, 4)}
+# design neighbours each hole forms triangles with for RANSAC hypotheses
+TRIANGLE_NEIGHBOURS = 6
+# detected neighbours, fewer: some design holes are missed
+DETECTED_NEIGHBOURS = 3
+ICP_ITERATIONS = 30
+# RANSAC stops once a better hypothesis would have been drawn this surely
+CONFIDENCE = 0.999
+
+TOOL_REGEX = re.compile(r"^T(\d+)(?:[FSB][\d.]+)*C([\d.]+)")
+TOOL_SELECT_REGEX = re.compile(r"^T(\d+)$")
+COORDINATE_REGEX = re.compile(r"([XY])([+-]?[\d.]+)")
+FILE_FORMAT_REGEX = re.compile(r"FILE_FORMAT=(\d+):(\d+)")
+NUMBER_FORMAT_REGEX = re.compile(r"^(0+)\.(0+)$")
+
+
+def _excellon_number(text: str, digits: typing.Tuple[int, int], zeros: str) -> float:
+    if "." in text:
+        return float(text)
+    sign = -1.0 if text.startswith("-") else 1.0
+    text = text.lstrip("+-")
+    integer, decimal = digits
+    if zeros == "TZ":
+        # trailing zeros kept, leading ones dropped
+        return sign * int(text) / 10**decimal
+    return sign * int(text.ljust(integer + decimal, "0")) / 10**decimal
+
+
+def load_excellon(path: str) -> (np.ndarray, np.ndarray):
+    """
+    Drill hits of an Excellon file as (N, 2) mm positions and their tool
+    diameters in mm. Routed slots and incremental mode are not supported.
+    """
+    to_mm, digits, zeros = 1.0, EXCELLON_DIGITS["METRIC"], "LZ"
+    # a FILE_FORMAT comment or format option beats the units' defaults,
+    # whichever comes first
+    explicit_digits = False
+    tools, diameter = {}, np.nan
+    x = y = 0.0
+    holes, diameters = [], []
+    with open(path) as f:
+        for line in f:
+            line = line.strip().upper()
+            if not line:
+                continue
+            if line.startswith(";"):
+                match = FILE_FORMAT_REGEX.search(line)
+                if match:
+                    digits = int(match.group(1)), int(match.group(2))
+                    explicit_digits = True
+                continue
+            if line.startswith(("METRIC", "INCH")):
+                units, *options = line.split(",")
+                to_mm = 25.4 if units == "INCH" else 1.0
+                if not explicit_digits:
+                    digits = EXCELLON_DIGITS[units]
+                for option in options:
+                    match = NUMBER_FORMAT_REGEX.match(option)
+                    if option in ("LZ", "TZ"):
+                        zeros = option
+                    elif match:
+                        digits = len(match.group(1)), len(match.group(2))
+                        explicit_digits = True
+                continue
+            if line in ("M71", "M72"):
+                to_mm = 1.0 if line == "M71" else 25.4
+                continue
+            match = TOOL_REGEX.match(line)
+            if match:
+                tools[int(match.group(1))] = float(match.group(2)) * to_mm
+                diameter = tools[int(match.group(1))]
+                continue
+            match = TOOL_SELECT_REGEX.match(line)
+            if match:
+                diameter = tools.get(int(match.group(1)), np.nan)
+                continue
+            if line[0] in "XY":
+                # a G85 slot only counts its first end
+                for axis, value in COORDINATE_REGEX.findall(line.split("G")[0]):
+                    value = _excellon_number(value, digits, zeros) * to_mm
+                    if axis == "X":
+                        x = value
+                    else:
+                        y = value
+                holes.append((x, y))
+                diameters.append(diameter)
+    return np.array(holes, dtype=np.float64).reshape(-1, 2), np.array(diameters)
+
+
+def load_drill_csv(path: str) -> (np.ndarray, np.ndarray):
+    """x,y[,diameter] in mm per line; headers and # comments are skipped"""
+    rows = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            try:
+                values = [float(value) for value in line.replace(";", ",").split(",")]
+            except ValueError:
+                continue
+            rows.append(values[:3] + [np.nan] * (3 - len(values[:3])))
+    data = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    return data[:, :2], data[:, 2]
+
+
+def load_drill_file(path: str) -> (np.ndarray, np.ndarray):
+    """Excellon (starts with M48 or a ; comment) or CSV by content"""
+    with open(path) as f:
+        head = f.read(256).lstrip()
+    if head.startswith(("M48", ";")) or "METRIC" in head or "INCH" in head:
+        return load_excellon(path)
+    return load_drill_csv(path)
+
+
+class KDIndex:
+    """
+    Exact nearest neighbour lookups over (N, D) points: a single FLANN
+    KD-tree, built once in O(n log n), O(log n) per query point
+    """
+
+    def __init__(self, points: np.ndarray, dims: int = 2):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, dims)
+        self._index = cv2.flann_Index(
+            self.points.astype(np.float32),
+            {"algorithm": FLANN_KDTREE_SINGLE, "leaf_max_size": 10},
+        )
+
+    def __len__(self):
+        return len(self.points)
+
+    def nearest(self, points: np.ndarray, k: int = 1) -> (np.ndarray, np.ndarray):
+        """(M, k) indices and distances of the k closest points"""
+        points = np.asarray(points, dtype=np.float32).reshape(-1, self.points.shape[1])
+        k = min(k, len(self.points))
+        if not len(points):
+            return np.zeros((0, k), dtype=int), np.zeros((0, k))
+        indices, squared = self._index.knnSearch(points, k, params={})
+        return indices.astype(int), np.sqrt(squared.astype(np.float64))
+
+
+class DesignHoles:
+    """
+    Holes of the board design in design mm with their diameters, indexed
+    for matching against detected holes
+    """
+
+    def __init__(self, holes: np.ndarray, diameters: np.ndarray = None):
+        self.holes = np.asarray(holes, dtype=np.float64).reshape(-1, 2)
+        if diameters is None:
+            diameters = np.full(len(self.holes), np.nan)
+        self.diameters = np.asarray(diameters, dtype=np.float64)
+        self.index = KDIndex(self.holes)
+        self._triangles = None
+
+    @classmethod
+    def from_file(cls, path: str):
+        return cls(*load_drill_file(path))
+
+    def __len__(self):
+        return len(self.holes)
+
+    def triangles(self) -> (np.ndarray, KDIndex):
+        """
+        Every hole with each ordered pair of its TRIANGLE_NEIGHBOURS closest
+        ones, (T, 3) indices, and a KD-tree over their side lengths
+        """
+        if self._triangles is None:
+            triangles = neighbour_triangles(self.holes, TRIANGLE_NEIGHBOURS)
+            sides = KDIndex(triangle_sides(self.holes, triangles), dims=3)
+            self._triangles = triangles, sides
+        return self._triangles
+
+
+def neighbour_triangles(points: np.ndarray, neighbours: int) -> np.ndarray:
+    """(T, 3) index triples a, b, c with b != c among the neighbours of a"""
+    indices, _ = KDIndex(points).nearest(points, neighbours + 1)
+    b, c = np.nonzero(~np.eye(indices.shape[1] - 1, dtype=bool))
+    return np.column_stack(
+        (
+            np.repeat(np.arange(len(points)), len(b)),
+            indices[:, 1:][:, b].ravel(),
+            indices[:, 1:][:, c].ravel(),
+        )
+    )
+
+
+def triangle_sides(points: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    """|ab|, |ac|, |bc| of every triangle, the key hypotheses are found by"""
+    a, b, c = (points[triangles[:, i]] for i in range(3))
+    return np.column_stack(
+        (np.hypot(*(b - a).T), np.hypot(*(c - a).T), np.hypot(*(c - b).T))
+    )
+
+
+def similarity_transform(src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """
+    Least squares rotation, uniform scale and translation taking src to
+    dst (Umeyama), as a 2x3 matrix
+    """
+    src_mean, dst_mean = src.mean(axis=0), dst.mean(axis=0)
+    src_c, dst_c = src - src_mean, dst - dst_mean
+    u, sigma, vt = np.linalg.svd(dst_c.T @ src_c / len(src))
+    # no reflections
+    d = np.array([1.0, np.sign(np.linalg.det(u) * np.linalg.det(vt)) or 1.0])
+    rotation = u @ np.diag(d) @ vt
+    variance = (src_c**2).sum() / len(src)
+    scale = (sigma * d).sum() / variance if variance else 1.0
+    translation = dst_mean - scale * rotation @ src_mean
+    return np.column_stack((scale * rotation, translation))
+
+
+def apply_similarity(matrix: np.ndarray, points: np.ndarray) -> np.ndarray:
+    return np.asarray(points).reshape(-1, 2) @ matrix[:, :2].T + matrix[:, 2]
+
+
+class Registration:
+    """
+    Design to board (machine work coordinates) similarity found by
+    register(); matches pairs detected hole indices with design holes
+    """
+
+    def __init__(self, matrix: np.ndarray, matches: np.ndarray, rms: float):
+        self.matrix = matrix
+        self.matches = matches
+        self.rms = rms
+
+    @property
+    def scale(self) -> float:
+        return float(np.sqrt(np.linalg.det(self.matrix[:, :2])))
+
+    @property
+    def rotation(self) -> float:
+        """Degrees, counter-clockwise"""
+        return float(np.degrees(np.arctan2(self.matrix[1, 0], self.matrix[0, 0])))
+
+    @property
+    def offset(self) -> np.ndarray:
+        return self.matrix[:, 2]
+
+    def to_board(self, points: np.ndarray) -> np.ndarray:
+        return apply_similarity(self.matrix, points)
+
+    def to_design(self, points: np.ndarray) -> np.ndarray:
+        return apply_similarity(cv2.invertAffineTransform(self.matrix), points)
+
+    def __repr__(self):
+        x, y = self.offset
+        return (
+            f"Registration(offset=({x:.3f}, {y:.3f}), rotation={self.rotation:.3f}, "
+            f"scale={self.scale:.5f}, rms={self.rms:.4f}, matches={len(self.matches)})"
+        )
+
+
+def _count_inliers(
+    design: DesignHoles, detected: np.ndarray, matrix: np.ndarray, tolerance: float
+) -> int:
+    _, distances = design.index.nearest(apply_similarity(matrix, detected))
+    return int((distances[:, 0] < tolerance).sum())
+
+
+def _refine(
+    design: DesignHoles, detected: np.ndarray, matrix: np.ndarray, tolerance: float
+) -> (np.ndarray, np.ndarray):
+    """ICP: re-match every detection to its closest design hole and re-solve"""
+    inliers = None
+    for _ in range(ICP_ITERATIONS):
+        indices, distances = design.index.nearest(apply_similarity(matrix, detected))
+        keep = distances[:, 0] < tolerance
+        if keep.sum() < 2:
+            break
+        matches = np.column_stack((np.flatnonzero(keep), indices[keep, 0]))
+        if inliers is not None and np.array_equal(matches, inliers):
+            break
+        inliers = matches
+        matrix = similarity_transform(detected[matches[:, 0]], design.holes[matches[:, 1]])
+    return matrix, inliers
+
+
+def register(
+    detected: np.ndarray,
+    design: DesignHoles,
+    tolerance: float = 0.25,
+    scale_range: typing.Tuple[float, float] = (0.95, 1.05),
+    iterations: int = 200,
+    candidates: int = 16,
+    min_inliers: int = 6,
+    seed: int = 0,
+) -> typing.Optional[Registration]:
+    """
+    Finds where the design sits on the machine from detected hole centres
+    (work mm), e.g. the holes of 3-4 views. RANSAC: a detection and two of
+    its neighbours are looked up by their side lengths among the design's
+    neighbour triangles (KD-tree), each candidate implies a similarity,
+    scored by the detections landing within tolerance of a design hole
+    (KD-tree again), and the best one is refined by ICP. Detections must
+    be in mm, scale_range only absorbs calibration error. None when no
+    hypothesis explains min_inliers detections.
+    """
+    detected = np.asarray(detected, dtype=np.float64).reshape(-1, 2)
+    if len(detected) < max(min_inliers, 3) or len(design) < 3:
+        return None
+    triangles, sides_index = design.triangles()
+    detected_triangles = neighbour_triangles(
+        detected, min(DETECTED_NEIGHBOURS, len(detected) - 1)
+    )
+    sides = triangle_sides(detected, detected_triangles)
+    rng = np.random.default_rng(seed)
+    best, best_inliers = None, 0
+    needed = iterations
+    for tried, triangle in enumerate(rng.permutation(len(detected_triangles))):
+        if tried >= needed:
+            break
+        found, distances = sides_index.nearest(sides[triangle], candidates)
+        # side lengths may be off by the scale error plus twice the noise
+        allowed = 2 * tolerance + sides[triangle].max() * (scale_range[1] - 1)
+        for match in found[0][distances[0] <= allowed]:
+            # detected -> design, checked against the design holes
+            matrix = similarity_transform(
+                detected[detected_triangles[triangle]], design.holes[triangles[match]]
+            )
+            scale = np.sqrt(abs(np.linalg.det(matrix[:, :2])))
+            if not 1 / scale_range[1] <= scale <= 1 / scale_range[0]:
+                continue
+            inliers = _count_inliers(design, detected, matrix, tolerance)
+            if inliers > best_inliers:
+                best, best_inliers = matrix, inliers
+                # all three corners of a sample must be inliers
+                clean = (inliers / len(detected)) ** 3
+                if clean >= 1:
+                    needed = 0
+                else:
+                    needed = min(
+                        iterations, np.log(1 - CONFIDENCE) / np.log(1 - clean)
+                    )
+    if best is None or best_inliers < min_inliers:
+        return None
+    matrix, matches = _refine(design, detected, best, tolerance)
+    if matches is None or len(matches) < min_inliers:
+        return None
+    # solved the other way round for board space residuals
+    matrix = similarity_transform(design.holes[matches[:, 1]], detected[matches[:, 0]])
+    residuals = apply_similarity(matrix, design.holes[matches[:, 1]]) - detected[matches[:, 0]]
+    rms = float(np.sqrt((residuals**2).sum(axis=1).mean()))
+    return Registration(matrix, matches, rms)
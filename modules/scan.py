@@ -0,0 +1,428 @@
+import collections
+import threading
+import time
+import typing
+
+import numpy as np
+
+from machine.grbl import GRBL
+from machine.status import MachineStatus
+from modules.calibration import PlaneTransform
+from modules.frames import FrameSlot
+from modules.tracking import GridIndex
+
+
+def plan_serpentine(
+    x_min: float, y_min: float, x_max: float, y_max: float, step_x: float, step_y: float
+) -> np.ndarray:
+    """
+    (N, 2) stops covering the rectangle row by row, every other row reversed
+    so the gantry never travels back across the board
+    """
+    xs = np.arange(x_min, x_max + step_x / 2, step_x)
+    ys = np.arange(y_min, y_max + step_y / 2, step_y)
+    rows = [
+        np.column_stack((xs if i % 2 == 0 else xs[::-1], np.full(len(xs), y)))
+        for i, y in enumerate(ys)
+    ]
+    return np.vstack(rows)
+
+
+def merge_holes(
+    points: np.ndarray, radius: float, sizes: np.ndarray = None
+) -> (np.ndarray, np.ndarray, typing.Optional[np.ndarray]):
+    """
+    Groups detections closer than radius (transitively) and returns the mean
+    position of each group with the number of detections in it and, given
+    the sizes of the detections, their mean size
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    index = GridIndex(points, radius)
+    group = np.full(len(points), -1)
+    groups = 0
+    for seed in range(len(points)):
+        if group[seed] != -1:
+            continue
+        group[seed] = groups
+        stack = [seed]
+        while stack:
+            for neighbour in index.query(points[stack.pop()], radius):
+                if group[neighbour] == -1:
+                    group[neighbour] = groups
+                    stack.append(neighbour)
+        groups += 1
+    counts = np.bincount(group, minlength=groups)
+    centres = np.zeros((groups, 2))
+    np.add.at(centres, group, points)
+    centres /= np.maximum(counts, 1)[:, None]
+    if sizes is None:
+        return centres, counts, None
+    sizes = np.bincount(group, weights=sizes, minlength=groups)
+    return centres, counts, sizes / np.maximum(counts, 1)
+
+
+def inside_margin(
+    points: np.ndarray, frame_shape: tuple, edge_margin: float
+) -> np.ndarray:
+    """
+    Mask of the points farther than edge_margin (fraction of the short side)
+    from the border
+    """
+    height, width = frame_shape[:2]
+    margin = edge_margin * min(width, height)
+    points = np.asarray(points).reshape(-1, 2)
+    return (
+        (points[:, 0] >= margin)
+        & (points[:, 0] <= width - margin)
+        & (points[:, 1] >= margin)
+        & (points[:, 1] <= height - margin)
+    )
+
+
+class BoardScanner:
+    """
+    Stop-and-go raster over the board: moves to every stop of a serpentine
+    plan, waits for the machine to report Idle, detects holes on frames
+    captured after that and maps them to board (work) coordinates. Runs on
+    its own thread, holes is the merged, deduplicated result. detect
+    returns the centres and blob areas (px) of the holes in a frame, sizes
+    holds the mean area of every hole.
+    """
+
+    def __init__(
+        self,
+        machine: GRBL,
+        slot: FrameSlot,
+        detect: typing.Callable[[np.ndarray], typing.Tuple[np.ndarray, np.ndarray]],
+        scale: PlaneTransform,
+        frames_per_stop: int = 2,
+        merge_radius: float = 0.3,
+        overlap: float = 0.2,
+        feed: int = 3000,
+        frame_timeout: float = 2.0,
+        edge_margin: float = 0.05,
+    ):
+        self.machine = machine
+        self.slot = slot
+        self.detect = detect
+        self.scale = scale
+        self.frames_per_stop = frames_per_stop
+        self.merge_radius = merge_radius
+        self.overlap = overlap
+        self.feed = feed
+        self.frame_timeout = frame_timeout
+        # holes cut by the frame border have biased centres, the overlapping
+        # neighbour tile sees them whole
+        self.edge_margin = edge_margin
+        self.stops = None
+        self.progress = 0
+        self.detections = []
+        self.detection_sizes = []
+        self.holes = np.zeros((0, 2))
+        self.counts = np.zeros(0, dtype=int)
+        self.sizes = np.zeros(0)
+        self.is_running = False
+        self._thread = None
+
+    def plan(self, extent: typing.Sequence[float], frame_shape: tuple) -> np.ndarray:
+        x_min, y_min, x_max, y_max = extent
+        fov_x, fov_y = self.scale.field_of_view(frame_shape)
+        step_x, step_y = fov_x * (1 - self.overlap), fov_y * (1 - self.overlap)
+        return plan_serpentine(x_min, y_min, x_max, y_max, step_x, step_y)
+
+    def _capture(self, settled_at: float) -> typing.List[np.ndarray]:
+        frames = []
+        frame_id = 0
+        while len(frames) < self.frames_per_stop:
+            latest = self.slot.wait_newer(frame_id, self.frame_timeout)
+            if latest is None:
+                raise TimeoutError("no frames from camera")
+            frame, frame_id, frame_time = latest
+            # frames exposed while the gantry was still moving are useless
+            if frame_time > settled_at:
+                frames.append(frame)
+        return frames
+
+    def _detect_inside(self, frame: np.ndarray) -> (np.ndarray, np.ndarray):
+        """Centres and areas of the holes away from the frame border"""
+        points, sizes = self.detect(frame)
+        keep = inside_margin(points, frame.shape, self.edge_margin)
+        return np.asarray(points).reshape(-1, 2)[keep], np.asarray(sizes)[keep]
+
+    def scan(self, extent: typing.Sequence[float]) -> np.ndarray:
+        frame_shape = self.slot.frame.shape
+        self.stops = self.plan(extent, frame_shape)
+        self.progress = 0
+        self.detections = []
+        self.detection_sizes = []
+        self.machine.send_command("G90")
+        for x, y in self.stops:
+            if not self.is_running:
+                break
+            self.machine.go_to(round(x, 3), round(y, 3), self.feed)
+            status = self.machine.wait_for_idle()
+            position = np.array(status.work_position[:2])
+            for frame in self._capture(status.received_at):
+                self._add_detections(frame, position)
+            self.progress += 1
+        return self._merge()
+
+    def _add_detections(self, frame: np.ndarray, position: np.ndarray):
+        points, sizes = self._detect_inside(frame)
+        if len(points):
+            self.detections.append(
+                position + self.scale.to_offsets(points, frame.shape)
+            )
+            self.detection_sizes.append(sizes)
+
+    def _merge(self) -> np.ndarray:
+        if self.detections:
+            self.holes, self.counts, self.sizes = merge_holes(
+                np.vstack(self.detections),
+                self.merge_radius,
+                np.concatenate(self.detection_sizes),
+            )
+        return self.holes
+
+    def _run(self, extent, on_done):
+        try:
+            self.scan(extent)
+            print(f"SCAN {len(self.holes)} holes")
+            if on_done:
+                on_done(self.holes, self.sizes)
+        except Exception as e:
+            print("SCAN FAILED", e)
+        finally:
+            self.is_running = False
+
+    def start(self, extent: typing.Sequence[float], on_done=None):
+        self.is_running = True
+        self._thread = threading.Thread(
+            target=self._run, args=(extent, on_done), name="BoardScanner", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.is_running = False
+
+
+def exposure_seconds(exposure_absolute: int) -> float:
+    """V4L2 exposure_absolute (as set by Droidcam setup) is in 100 us units"""
+    return exposure_absolute * 100e-6
+
+
+def max_scan_feed(exposure: float, mm_per_px: float, blur_px: float = 0.5) -> float:
+    """
+    Highest feed in mm/min at which the image moves less than blur_px during
+    one exposure of exposure seconds
+    """
+    return blur_px * mm_per_px / exposure * 60
+
+
+class PositionHistory:
+    """
+    Recent (time, X, Y) work positions from status reports, to look up where
+    the gantry was when a frame was captured. Both clocks are
+    time.monotonic(); latency is subtracted from the report arrival time to
+    account for the serial round trip.
+    """
+
+    def __init__(self, size: int = 4096, latency: float = 0.0):
+        self.latency = latency
+        self._samples = collections.deque(maxlen=size)
+
+    def add(self, t: float, x: float, y: float):
+        self._samples.append((t - self.latency, x, y))
+
+    def on_status(self, event: str, status: MachineStatus):
+        # GRBL.subscribe callback
+        if event == "status" and status.work_position is not None:
+            self.add(status.received_at, *status.work_position[:2])
+
+    def at(self, times) -> np.ndarray:
+        """
+        (N, 2) positions interpolated at times, NaN outside the recorded span
+        """
+        samples = np.array(self._samples, dtype=np.float64).reshape(-1, 3)
+        times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+        if len(samples) < 2:
+            return np.full((len(times), 2), np.nan)
+        positions = np.column_stack(
+            [np.interp(times, samples[:, 0], samples[:, axis]) for axis in (1, 2)]
+        )
+        outside = (times < samples[0, 0]) | (times > samples[-1, 0])
+        positions[outside] = np.nan
+        return positions
+
+
+def detect_tagged_frames(
+    frames: typing.Iterable[np.ndarray],
+    frame_times: typing.Sequence[float],
+    history: PositionHistory,
+    detect: typing.Callable[[np.ndarray], typing.Tuple[np.ndarray, np.ndarray]],
+    scale: PlaneTransform,
+    merge_radius: float = 0.3,
+    edge_margin: float = 0.05,
+) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Offline half of a continuous scan: tags every frame with the position
+    interpolated at its capture time, detects and merges holes. Works the
+    same on a live history or one rebuilt from a recorded log.
+    """
+    positions = history.at(frame_times)
+    detections, detection_sizes = [], []
+    for frame, position in zip(frames, positions):
+        if np.isnan(position).any():
+            continue
+        points, sizes = detect(frame)
+        keep = inside_margin(points, frame.shape, edge_margin)
+        if keep.any():
+            points = np.asarray(points).reshape(-1, 2)[keep]
+            detections.append(position + scale.to_offsets(points, frame.shape))
+            detection_sizes.append(np.asarray(sizes)[keep])
+    if not detections:
+        return np.zeros((0, 2)), np.zeros(0, dtype=int), np.zeros(0)
+    return merge_holes(
+        np.vstack(detections), merge_radius, np.concatenate(detection_sizes)
+    )
+
+
+def save_scan_log(path, frames, frame_times, status_times, positions):
+    np.savez_compressed(
+        path,
+        frames=np.asarray(frames),
+        frame_times=np.asarray(frame_times),
+        status_times=np.asarray(status_times),
+        positions=np.asarray(positions),
+    )
+
+
+def load_scan_log(path) -> (np.ndarray, np.ndarray, PositionHistory):
+    """
+    Returns frames, frame times and the position history of a log written
+    by save_scan_log
+    """
+    with np.load(path) as log:
+        history = PositionHistory(size=len(log["status_times"]) + 1)
+        for t, (x, y) in zip(log["status_times"], log["positions"]):
+            history.add(t, x, y)
+        return log["frames"], log["frame_times"], history
+
+
+class ContinuousScanner(BoardScanner):
+    """
+    Scans each raster row in one constant-feed G1 move and detects holes
+    while the gantry moves, instead of stopping at every tile. Detections
+    are tagged with the position interpolated from the status reports
+    around their frame's capture time; frames are only kept with keep_log.
+    The feed is capped so the image moves at most blur_px during one
+    exposure.
+    """
+
+    def __init__(
+        self,
+        machine: GRBL,
+        slot: FrameSlot,
+        detect: typing.Callable[[np.ndarray], typing.Tuple[np.ndarray, np.ndarray]],
+        scale: PlaneTransform,
+        exposure: float,
+        blur_px: float = 0.5,
+        status_latency: float = 0.0,
+        keep_log: bool = False,
+        **kwargs,
+    ):
+        super().__init__(machine, slot, detect, scale, **kwargs)
+        self.travel_feed = self.feed
+        self.feed = min(self.feed, max_scan_feed(exposure, scale.mm_per_px, blur_px))
+        self.history = PositionHistory(latency=status_latency)
+        self.keep_log = keep_log
+        self.log = {"frames": [], "frame_times": [], "status_times": [], "positions": []}
+
+    def plan_rows(self, extent, frame_shape) -> np.ndarray:
+        """(rows, 2, 2) start and end point of every row, alternating direction"""
+        stops = self.plan(extent, frame_shape)
+        xs = np.unique(stops[:, 0])
+        rows = []
+        for i, y in enumerate(np.unique(stops[:, 1])):
+            start, end = (xs[0], xs[-1]) if i % 2 == 0 else (xs[-1], xs[0])
+            rows.append(((start, y), (end, y)))
+        return np.array(rows)
+
+    def _record(self, event: str, status: MachineStatus):
+        self.history.on_status(event, status)
+        if self.keep_log and event == "status" and status.work_position is not None:
+            self.log["status_times"].append(status.received_at)
+            self.log["positions"].append(status.work_position[:2])
+
+    def _tag_detections(self, pending: list) -> list:
+        """
+        Places the detections whose capture time the status history already
+        covers, returns those still waiting for a later report
+        """
+        if not pending:
+            return pending
+        positions = self.history.at([item[0] for item in pending])
+        waiting = []
+        for item, position in zip(pending, positions):
+            if np.isnan(position).any():
+                waiting.append(item)
+                continue
+            _, points, sizes, frame_shape = item
+            self.detections.append(position + self.scale.to_offsets(points, frame_shape))
+            self.detection_sizes.append(sizes)
+        return waiting
+
+    def _scan_row(self, end: np.ndarray):
+        """
+        Detects holes on every frame as it arrives; only the points are
+        kept, until the status reports around their capture time are in
+        """
+        pending = []
+        frame_id = self.slot.frame_id
+        started = time.monotonic()
+        self.machine.send_command(f"G1X{end[0]:.3f}Y{end[1]:.3f}F{self.feed:.0f}")
+        # acknowledged once the row move has finished, a status report
+        # polled right after the G1 may still say Idle
+        finished = self.machine.send_command("G4P0", wait_ok=False)
+        while self.is_running and not finished.done():
+            latest = self.slot.wait_newer(frame_id, self.frame_timeout)
+            if latest is None:
+                raise TimeoutError("no frames from camera")
+            frame, frame_id, frame_time = latest
+            if frame_time > started:
+                points, sizes = self._detect_inside(frame)
+                if len(points):
+                    pending.append((frame_time, points, sizes, frame.shape))
+                if self.keep_log:
+                    self.log["frames"].append(frame)
+                    self.log["frame_times"].append(frame_time)
+            pending = self._tag_detections(pending)
+        # a report after the end of the move covers the last frames, any
+        # still untagged were captured outside the history and are dropped
+        self.machine.wait_for_idle()
+        self._tag_detections(pending)
+
+    def scan(self, extent: typing.Sequence[float]) -> np.ndarray:
+        frame_shape = self.slot.frame.shape
+        rows = self.plan_rows(extent, frame_shape)
+        self.stops = rows.reshape(-1, 2)
+        self.progress = 0
+        self.detections = []
+        self.detection_sizes = []
+        self.machine.subscribe(self._record)
+        try:
+            self.machine.send_command("G90")
+            for start, end in rows:
+                if not self.is_running:
+                    break
+                self.machine.go_to(round(start[0], 3), round(start[1], 3), self.travel_feed)
+                self.machine.wait_for_idle()
+                self._scan_row(end)
+                self.progress += 2
+        finally:
+            self.machine.unsubscribe(self._record)
+        return self._merge()
+
+    def save_log(self, path):
+        save_scan_log(path, **self.log)
@@ -0,0 +1,28 @@
+import time
+
+from imutils.video import WebcamVideoStream
+
+from modules.frames import FrameSlot
+
+
+class SequencedVideoStream(WebcamVideoStream):
+    """
+    WebcamVideoStream that publishes every grabbed frame to a FrameSlot,
+    so readers can tell a new frame from the one they already processed
+    """
+
+    def __init__(self, src=0, name="SequencedVideoStream"):
+        super().__init__(src=src, name=name)
+        self.slot = FrameSlot()
+        if self.grabbed:
+            self.slot.publish(self.frame)
+
+    def update(self):
+        while not self.stopped:
+            grabbed, frame = self.stream.read()
+            self.grabbed = grabbed
+            if grabbed:
+                self.frame = frame
+                self.slot.publish(frame)
+            else:
+                time.sleep(0.01)
@@ -0,0 +1,120 @@
+import collections
+import itertools
+import typing
+
+import numpy as np
+
+
+class GridIndex:
+    """
+    Spatial hash of 2D points in square cells. With cell_size at least the
+    query radius a lookup only visits the 3x3 cells around the point.
+    """
+
+    def __init__(self, points: np.ndarray, cell_size: float):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = float(cell_size)
+        self._cells = collections.defaultdict(list)
+        keys = np.floor(self.points / self.cell_size).astype(np.int64)
+        for index, (cx, cy) in enumerate(keys.tolist()):
+            self._cells[cx, cy].append(index)
+
+    def query(self, point, radius: float) -> typing.List[int]:
+        """Indices of the points within radius of point"""
+        cx, cy = int(point[0] // self.cell_size), int(point[1] // self.cell_size)
+        span = int(np.ceil(radius / self.cell_size))
+        candidates = [
+            index
+            for dx in range(-span, span + 1)
+            for dy in range(-span, span + 1)
+            for index in self._cells.get((cx + dx, cy + dy), ())
+        ]
+        if not candidates:
+            return []
+        d2 = ((self.points[candidates] - point) ** 2).sum(axis=1)
+        return [candidates[i] for i in np.flatnonzero(d2 <= radius * radius)]
+
+    def nearest(self, point, radius: float, exclude=()) -> int:
+        """Index of the closest point within radius not in exclude, or -1"""
+        best, best_d2 = -1, radius * radius
+        for index in self.query(point, radius):
+            if index in exclude:
+                continue
+            d2 = ((self.points[index] - point) ** 2).sum()
+            if d2 <= best_d2:
+                best, best_d2 = index, d2
+        return best
+
+
+class Track:
+    __slots__ = ("id", "center", "confidence", "hits", "misses")
+
+    def __init__(self, track_id: int, center: np.ndarray, confidence: float):
+        self.id = track_id
+        self.center = center
+        self.confidence = confidence
+        self.hits = 1
+        self.misses = 0
+
+    def __repr__(self):
+        return (
+            f"Track({self.id}, ({self.center[0]:.2f}, {self.center[1]:.2f}), "
+            f"confidence={self.confidence:.2f})"
+        )
+
+
+class HoleTracker:
+    """
+    Follows hole centres across frames: each detection is matched to the
+    closest track within match_radius pixels, the track centre is smoothed
+    with an exponential moving average and keeps a stable id. confidence
+    rises towards 1 while a hole keeps being seen and decays when missed;
+    tracks missed more than max_misses frames in a row are dropped.
+    """
+
+    def __init__(
+        self, match_radius: float = 5.0, smoothing: float = 0.3, max_misses: int = 5
+    ):
+        self.match_radius = match_radius
+        self.smoothing = smoothing
+        self.max_misses = max_misses
+        self.tracks: typing.List[Track] = []
+        self._ids = itertools.count(1)
+
+    def reset(self):
+        self.tracks = []
+
+    def update(self, centers: np.ndarray) -> typing.List[Track]:
+        """
+        centers is an (N, 2) float array of this frame's detections, returns
+        the tracks seen in this frame
+        """
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        index = GridIndex(centers, self.match_radius)
+        alpha = self.smoothing
+        claimed = set()
+        seen = []
+        alive = []
+        # most established tracks pick their detection first
+        for track in sorted(self.tracks, key=lambda t: -t.confidence):
+            match = index.nearest(track.center, self.match_radius, claimed)
+            if match == -1:
+                track.misses += 1
+                track.confidence *= 1 - alpha
+                if track.misses <= self.max_misses:
+                    alive.append(track)
+                continue
+            claimed.add(match)
+            track.center = track.center + alpha * (centers[match] - track.center)
+            track.confidence += alpha * (1 - track.confidence)
+            track.hits += 1
+            track.misses = 0
+            alive.append(track)
+            seen.append(track)
+        for i in range(len(centers)):
+            if i not in claimed:
+                track = Track(next(self._ids), centers[i].copy(), alpha)
+                alive.append(track)
+                seen.append(track)
+        self.tracks = alive
+        return seen
@@ -173,6 +173,8 @@ def solve_marker_plane(im, image_points, calibrator, center):
              offset_point((80, 50), rotation_vector, translation_vector, camera_matrix,
                           dist_coeffs), (0, 225, 0), 2)
 
+    return rotation_vector, translation_vector
+
 
 def combine_two_color_images_with_anchor(background, foreground, anchor_x=0, anchor_y=0,
                                          alpha=0):
@@ -238,12 +240,11 @@ def get_contour_extremes(c):
     # plot_point(img, extRight, color)
 
 
-def apply_brightness_contrast(
-        input_img: np.ndarray, brightness=127, contrast=127
-) -> np.ndarray:
+def brightness_contrast_params(brightness=127, contrast=127):
     brightness = interp(brightness, [0, 255], [-126, 126])
     contrast = interp(contrast, [0, 255], [-126, 126])
 
+    alpha_b, gamma_b = 1.0, 0.0
     if brightness != 0:
         if brightness > 0:
             shadow = brightness
@@ -254,14 +255,74 @@ def apply_brightness_contrast(
         alpha_b = (highlight - shadow) / 255
         gamma_b = shadow
 
-        buf = cv2.addWeighted(input_img, alpha_b, input_img, 0, gamma_b)
-    else:
-        buf = input_img.copy()
-
+    alpha_c, gamma_c = 1.0, 0.0
     if contrast != 0:
         f = float(131 * (contrast + 127)) / (127 * (131 - contrast))
         alpha_c = f
         gamma_c = 127 * (1 - f)
 
-        buf = cv2.addWeighted(buf, alpha_c, buf, 0, gamma_c)
+    return (alpha_b, gamma_b), (alpha_c, gamma_c)
+
+
+def reuse_buffer(buf, shape, dtype=np.uint8) -> np.ndarray:
+    if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+        return np.empty(shape, dtype=dtype)
     return buf
+
+
+def make_brightness_contrast_lut(brightness=127, contrast=127) -> np.ndarray:
+    """
+    256-entry table equivalent to the two addWeighted passes of
+    apply_brightness_contrast, rounding and saturating after each pass
+    """
+    (alpha_b, gamma_b), (alpha_c, gamma_c) = brightness_contrast_params(
+        brightness, contrast
+    )
+    values = np.arange(256, dtype=np.float64)
+    values = np.clip(np.rint(values * alpha_b + gamma_b), 0, 255)
+    values = np.clip(np.rint(values * alpha_c + gamma_c), 0, 255)
+    return values.astype(np.uint8)
+
+
+class BrightnessContrastLUT:
+    """
+    Brightness/contrast as a single cv2.LUT pass.
+
+    The table is rebuilt only when brightness or contrast change and, unless
+    out is given, the result is written into one reused output buffer, so the
+    returned array is only valid until the next call.
+    """
+
+    def __init__(self):
+        self._key = None
+        self._lut = None
+        self._buf = None
+
+    def lut(self, brightness=127, contrast=127) -> np.ndarray:
+        key = (brightness, contrast)
+        if key != self._key:
+            self._lut = make_brightness_contrast_lut(brightness, contrast)
+            self._key = key
+        return self._lut
+
+    def __call__(
+        self,
+        input_img: np.ndarray,
+        brightness=127,
+        contrast=127,
+        inplace=False,
+        out: np.ndarray = None,
+    ) -> np.ndarray:
+        lut = self.lut(brightness, contrast)
+        if inplace:
+            return cv2.LUT(input_img, lut, dst=input_img)
+        if out is not None:
+            return cv2.LUT(input_img, lut, dst=out)
+        self._buf = reuse_buffer(self._buf, input_img.shape, input_img.dtype)
+        return cv2.LUT(input_img, lut, dst=self._buf)
+
+
+def apply_brightness_contrast(
+        input_img: np.ndarray, brightness=127, contrast=127
+) -> np.ndarray:
+    return cv2.LUT(input_img, make_brightness_contrast_lut(brightness, contrast))
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from machine.exceptions import GRBLError
+from machine.grbl import GRBL, RX_BUFFER_SIZE
+from machine.simulator import GRBLSimulator
+
+
+@pytest.fixture
+def sim():
+    sim = GRBLSimulator().start()
+    yield sim
+    sim.stop()
+
+
+@pytest.fixture
+def machine(sim):
+    machine = GRBL(sim.port)
+    yield machine
+    machine.close()
+
+
+def test_stream_keeps_rx_buffer_within_limit(sim, machine):
+    # lines of varying length, so the counted bytes rarely fill 127 exactly
+    program = [f"G1X{i % 97}.{i % 7}Y{i // 3}F{1000 + i}" for i in range(400)]
+    futures = machine.stream(program)
+    for future in futures:
+        assert future.result(timeout=10) in program
+    assert sim.lines == program
+    assert sim.overflows == 0
+    assert RX_BUFFER_SIZE - 20 < sim.rx_peak <= RX_BUFFER_SIZE
+
+
+def test_stream_drops_comments_and_reports_errors(sim, machine):
+    futures = machine.stream(["(start)", "G0X1 ; rapid", "", "Q5", "G0X2"])
+    assert len(futures) == 3
+    assert futures[0].result(timeout=5) == "G0X1"
+    with pytest.raises(GRBLError):
+        futures[1].result(timeout=5)
+    assert futures[2].result(timeout=5) == "G0X2"
+    assert sim.position[0] == 2.0
+
+
+def test_line_longer_than_rx_buffer_is_refused(machine):
+    with pytest.raises(ValueError):
+        machine.send_command("G0X" + "1" * RX_BUFFER_SIZE)
+
+
+def test_wait_for_idle_waits_for_queued_lines(sim, machine):
+    sim.line_time = 0.02
+    program = [f"G0X{i}" for i in range(10)]
+    machine.stream(program)
+    started = time.monotonic()
+    status = machine.wait_for_idle(timeout=5)
+    assert time.monotonic() - started >= 0.1
+    assert sim.lines == program + ["G4P0"]
+    assert status.state == "Idle"
+    assert status.received_at > started
+
+
+def test_wait_for_idle_times_out_while_running(sim, machine):
+    sim.state = "Run"
+    with pytest.raises(TimeoutError):
+        machine.wait_for_idle(timeout=0.3)
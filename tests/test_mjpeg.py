@@ -0,0 +1,84 @@
+import http.server
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from modules.mjpeg import EOI, SOI, MjpegStream, find_last_jpeg
+
+FRAMES = [
+    cv2.imencode(".jpg", np.full((120, 160, 3), level, np.uint8))[1].tobytes()
+    for level in (0, 80, 160, 240)
+]
+
+
+class MjpegHandler(http.server.BaseHTTPRequestHandler):
+    """Endless multipart stream, written in pieces that split the markers"""
+
+    protocol_version = "HTTP/1.1"
+    requests = 0
+
+    def do_GET(self):
+        MjpegHandler.requests += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+        self.end_headers()
+        try:
+            for i in range(100000):
+                jpeg = FRAMES[i % len(FRAMES)]
+                part = (
+                    b"--frame\r\nContent-Type: image/jpeg\r\n"
+                    b"Content-Length: %d\r\n\r\n" % len(jpeg) + jpeg + b"\r\n"
+                )
+                for k in range(0, len(part), 997):
+                    self.wfile.write(part[k : k + 997])
+                self.wfile.flush()
+                time.sleep(0.005)
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    MjpegHandler.requests = 0
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MjpegHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_find_last_jpeg_skips_stale_frames():
+    buf = bytearray(b"--" + SOI + b"a" + EOI + b"--" + SOI + b"bb" + EOI + b"--")
+    begin, end = find_last_jpeg(buf)
+    assert bytes(buf[begin:end]) == SOI + b"bb" + EOI
+
+
+def test_find_last_jpeg_waits_for_the_end_marker():
+    buf = bytearray(b"--" + SOI + b"partial" + EOI[:1])
+    assert find_last_jpeg(buf, 2) == (-1, 2)
+
+
+def test_stream_decodes_frames_over_one_connection(server):
+    stream = MjpegStream(f"http://127.0.0.1:{server.server_port}/video").start()
+    try:
+        frame_id, levels = 0, set()
+        deadline = time.monotonic() + 5
+        while len(levels) < len(FRAMES) and time.monotonic() < deadline:
+            latest = stream.slot.wait_newer(frame_id, timeout=1)
+            assert latest is not None
+            frame, frame_id, _ = latest
+            assert frame.shape == (120, 160, 3)
+            levels.add(int(frame[60, 80, 0]))
+        assert len(levels) == len(FRAMES)
+        assert frame_id >= len(FRAMES)
+        assert stream.connections == 1
+        assert MjpegHandler.requests == 1
+    finally:
+        stream.stop()
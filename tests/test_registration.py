@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from modules.registration import load_drill_file, load_excellon
+
+
+def write(tmp_path, text: str) -> str:
+    path = tmp_path / "board.drl"
+    path.write_text(text)
+    return str(path)
+
+
+def test_file_format_comment_before_units_line(tmp_path):
+    # header order written by Altium
+    path = write(
+        tmp_path,
+        "M48\n;FILE_FORMAT=2:5\nINCH,TZ\nT1C0.0394\n%\nT1\nX125000Y100000\nM30\n",
+    )
+    holes, diameters = load_excellon(path)
+    assert np.allclose(holes, [(31.75, 25.4)])
+    assert np.allclose(diameters, [0.0394 * 25.4])
+
+
+def test_file_format_comment_after_units_line(tmp_path):
+    path = write(tmp_path, "M48\nINCH,TZ\n;FILE_FORMAT=2:5\n%\nX125000Y100000\n")
+    holes, _ = load_excellon(path)
+    assert np.allclose(holes, [(31.75, 25.4)])
+
+
+@pytest.mark.parametrize(
+    "header, coordinates, expected",
+    [
+        # metric defaults to 3:3, inch to 2:4
+        ("METRIC,TZ", "X12500Y-2000", (12.5, -2.0)),
+        ("METRIC,LZ", "X0125Y002", (12.5, 2.0)),
+        ("INCH,TZ", "X12500Y10000", (31.75, 25.4)),
+        ("INCH,LZ", "X0125Y01", (31.75, 25.4)),
+        # the format option of the units line
+        ("METRIC,TZ,0000.00", "X1250Y200", (12.5, 2.0)),
+        ("METRIC,LZ,0000.00", "X00125Y0002", (12.5, 2.0)),
+        # decimal points need no format
+        ("METRIC,LZ", "X12.5Y2.", (12.5, 2.0)),
+    ],
+)
+def test_zero_suppression_and_digits(tmp_path, header, coordinates, expected):
+    path = write(tmp_path, f"M48\n{header}\nT1C0.8\n%\nT1\n{coordinates}\nM30\n")
+    holes, diameters = load_excellon(path)
+    assert np.allclose(holes, [expected])
+    # tool diameters are in the file's units too
+    to_mm = 25.4 if header.startswith("INCH") else 1.0
+    assert np.allclose(diameters, [0.8 * to_mm])
+
+
+def test_tools_and_modal_coordinates(tmp_path):
+    path = write(
+        tmp_path,
+        "M48\nMETRIC,TZ\nT1C0.8\nT2F00S00C1.0\n%\nT1\nX1000Y1000\nY2000\nT2\nX3000\nM30\n",
+    )
+    holes, diameters = load_drill_file(path)
+    assert np.allclose(holes, [(1, 1), (1, 2), (3, 2)])
+    assert np.allclose(diameters, [0.8, 0.8, 1.0])
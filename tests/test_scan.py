@@ -0,0 +1,93 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from machine.grbl import GRBL
+from machine.simulator import GRBLSimulator
+from modules.calibration import PlaneTransform
+from modules.detection import detect_blobs
+from modules.drill import plan_drill_job
+from modules.frames import FrameSlot
+from modules.scan import BoardScanner, merge_holes
+
+MM_PER_PX = 0.05
+WIDTH, HEIGHT = 320, 240
+# a 5 x 4 grid of holes, small and large ones alternating, radius in px
+HOLES = np.array([(2.0 + 3 * i, 2.0 + 3 * j) for j in range(4) for i in range(5)])
+RADII = np.array([4 if (i + j) % 2 else 9 for j in range(4) for i in range(5)])
+
+
+def render(position) -> np.ndarray:
+    """Camera view of the board with the machine at position"""
+    img = np.full((HEIGHT, WIDTH, 3), 220, np.uint8)
+    for (x, y), radius in zip(HOLES, RADII):
+        px = (x - position[0]) / MM_PER_PX + WIDTH / 2
+        py = HEIGHT / 2 - (y - position[1]) / MM_PER_PX
+        cv2.circle(img, (int(round(px)), int(round(py))), int(radius), (20, 20, 20), -1)
+    return img
+
+
+def detect(frame: np.ndarray) -> (np.ndarray, np.ndarray):
+    grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(grey, 127, 255, cv2.THRESH_BINARY_INV)
+    blobs = detect_blobs(binary, 20, 2000)
+    return blobs.centroids, blobs.areas
+
+
+@pytest.fixture
+def camera():
+    sim = GRBLSimulator().start()
+    machine = GRBL(sim.port)
+    slot = FrameSlot()
+    stop = threading.Event()
+
+    def capture():
+        while not stop.is_set():
+            slot.publish(render(sim.position))
+            time.sleep(0.005)
+
+    threading.Thread(target=capture, daemon=True).start()
+    while slot.frame is None:
+        time.sleep(0.005)
+    yield machine, slot
+    stop.set()
+    machine.close()
+    sim.stop()
+
+
+def test_merge_holes_averages_sizes():
+    points = np.array([(0.0, 0.0), (0.1, 0.0), (5.0, 5.0)])
+    centres, counts, sizes = merge_holes(points, 0.3, np.array([10.0, 20.0, 50.0]))
+    order = np.argsort(centres[:, 0])
+    assert np.allclose(centres[order], [(0.05, 0.0), (5.0, 5.0)])
+    assert list(counts[order]) == [2, 1]
+    assert np.allclose(sizes[order], [15.0, 50.0])
+    assert merge_holes(points, 0.3)[2] is None
+
+
+def test_scanned_sizes_give_drill_classes(camera):
+    machine, slot = camera
+    scanner = BoardScanner(
+        machine, slot, detect, PlaneTransform.from_scale(MM_PER_PX)
+    )
+    scanner.is_running = True
+    holes = scanner.scan((0, 0, 16, 12))
+    assert len(holes) == len(HOLES)
+    assert scanner.sizes.shape == (len(HOLES),)
+
+    job = plan_drill_job(holes, scanner.sizes, (20, 300), classes=2)
+    assert list(job.classes) == sorted(job.classes)
+    small = np.pi * 4**2
+    expected = [0 if area < 2 * small else 1 for area in scanner.sizes]
+    assert sorted(expected) == list(job.classes)
+    assert set(job.classes) == {0, 1}
+
+    program = job.gcode(spindle_speed=10000)
+    pause = program.index("M0")
+    assert program[pause - 1] == "M5"
+    assert program[pause + 1] == "M3S10000"
+    assert program.count("M0") == 1
+    assert program.index("(size class 0)") < pause < program.index("(size class 1)")
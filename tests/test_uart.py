@@ -0,0 +1,62 @@
+import json
+import os
+import pty
+
+import pytest
+from serial.tools.list_ports_common import ListPortInfo
+
+import tools.uart as uart
+from machine.simulator import GRBLSimulator
+
+
+def port_info(device: str, vid: int, serial_number: str = None) -> ListPortInfo:
+    port = ListPortInfo(device, True)
+    port.vid = vid
+    port.serial_number = serial_number
+    return port
+
+
+@pytest.fixture
+def ports(monkeypatch):
+    """A GRBL simulator, a silent serial device and the ports probed"""
+    sim = GRBLSimulator().start()
+    master, slave = pty.openpty()
+    probed = []
+    probe_grbl = uart.probe_grbl
+
+    def probe(device, timeout):
+        probed.append(device)
+        return probe_grbl(device, timeout)
+
+    monkeypatch.setattr(uart, "probe_grbl", probe)
+    yield sim.port, os.ttyname(slave), probed
+    sim.stop()
+    os.close(master)
+    os.close(slave)
+
+
+def test_stale_cache_entry_falls_back_to_search(ports, tmp_path):
+    grbl, silent, probed = ports
+    cache = tmp_path / "ports.json"
+    cache.write_text(json.dumps({"serial_numbers": {"A": silent}}))
+    candidates = [port_info(silent, 0x1A86, "A"), port_info(grbl, 0x1A86, "B")]
+    assert uart.find_grbl(candidates, 0.3, str(cache)) == grbl
+    assert probed == [silent, grbl]
+    assert json.loads(cache.read_text())["serial_numbers"]["B"] == grbl
+
+
+def test_cached_port_is_probed_alone(ports, tmp_path):
+    grbl, silent, probed = ports
+    cache = tmp_path / "ports.json"
+    cache.write_text(json.dumps({"serial_numbers": {"B": grbl}}))
+    candidates = [port_info(silent, 0x1A86), port_info(grbl, 0x1A86, "B")]
+    assert uart.find_grbl(candidates, 0.3, str(cache)) == grbl
+    assert probed == [grbl]
+
+
+def test_unknown_vendors_only_probed_on_request(ports):
+    grbl, silent, probed = ports
+    candidates = [port_info(grbl, 0x1234)]
+    assert uart.find_grbl(candidates, 0.3, None) is None
+    assert probed == []
+    assert uart.find_grbl(candidates, 0.3, None, probe_unknown=True) == grbl
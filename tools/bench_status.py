@@ -0,0 +1,59 @@
+"""
+Micro-benchmark of machine.status.parse_status against the regex + Decimal
+status parsing GRBL.read_machine used before it.
+
+    python -m tools.bench_status [iterations]
+"""
+import re
+import sys
+import timeit
+from decimal import Decimal, getcontext
+
+from machine.status import parse_status
+
+STATUS_REGEX = r"""<(?P<State>Idle|Run|Hold|Home|Alarm|Check|Door|Jog)(?:,MPos:(?P<MX>-?[0-9\.]*),(?P<MY>-?[0-9\.]*),(?P<MZ>-?[0-9\.]*))?(?:,WPos:(?P<WX>-?[0-9\.]*),(?P<WY>-?[0-9\.]*),(?P<WZ>-?[0-9\.]*))?(?:,Buf:(?P<Buf>[0-9]*))?(?:,RX:(?P<RX>[0-9]*))?(?:,Ln:(?P<L>[0-9]*))?(?:,F:(?P<F>-?[0-9\.]*))?(?:,Lim:(?P<Lim>[0-1]*))?(?:,Ctl:(?P<Ctl>[0-1]*))?(?:,FS:(?P<FS1>[0-9]*),(?P<FS2>[0-9]*))?(?:,Ov:(?P<OvFeed>-?[0-9\.]*),(?P<OvRapid>-?[0-9\.]*),(?P<OvSpindle>-?[0-9\.]*))?(?:,WCO:(?P<WCX>-?[0-9\.]*),(?P<WCY>-?[0-9\.]*),(?P<WCZ>-?[0-9\.]*))?>"""
+
+REPORTS = [
+    '<Idle|MPos:123.456,-78.900,-1.250|FS:0,0|WCO:10.000,20.000,0.000>',
+    '<Run|MPos:45.120,67.890,-2.000|Bf:15,128|FS:1500,0>',
+    '<Jog|WPos:1.529,-5.440,-0.000|Bf:14,120|FS:2000,0|Ov:100,100,100>',
+    '<Idle,MPos:5.529,0.560,7.000,WPos:1.529,-5.440,-0.000,Buf:0,RX:0>',
+]
+
+
+def regex_parse(line, matcher=re.compile(STATUS_REGEX)):
+    # what GRBL.read_machine did for every status line
+    result = matcher.match(line.replace('|', ','))
+    if not result:
+        return None
+    state = result.group('State')
+    machine_position = work_position = None
+    mpos = result.group('MX'), result.group('MY'), result.group('MZ')
+    wpos = result.group('WX'), result.group('WY'), result.group('WZ')
+    wco = result.group('WCX'), result.group('WCY'), result.group('WCZ')
+    if mpos[0]:
+        machine_position = tuple(map(Decimal, mpos))
+        if wco[0]:
+            offset = tuple(map(Decimal, wco))
+            work_position = tuple(m - o for m, o in zip(machine_position, offset))
+    if wpos[0] and wco[0]:
+        work_position = tuple(map(Decimal, wpos))
+        offset = tuple(map(Decimal, wco))
+        machine_position = tuple(w + o for w, o in zip(work_position, offset))
+    return state, machine_position, work_position
+
+
+def main(iterations=100000):
+    getcontext().prec = 3
+    print('regex path, WPos rounded to 3 digits:', regex_parse(REPORTS[0]))
+    print('split parser:', parse_status(REPORTS[0]))
+    for name, parse in (('regex+Decimal', regex_parse), ('parse_status', parse_status)):
+        seconds = timeit.timeit(
+            lambda: [parse(line) for line in REPORTS], number=iterations
+        )
+        per_line = seconds / (iterations * len(REPORTS)) * 1e6
+        print(f'{name:>14}: {per_line:.2f} us/report')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
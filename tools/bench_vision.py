@@ -0,0 +1,219 @@
+"""
+Headless benchmark of the ScannerApp vision pipeline: _apply_filters,
+_detect_holes and the overlay drawing, over a directory of images or a
+frame recording, at several resolutions and search window sizes. Prints
+per-stage p50/p99 latency in ms, FPS and per-frame allocations as JSON.
+
+    python -m tools.bench_vision assets --sizes 640x360,1920x1080 --roi 100,400
+    python -m tools.bench_vision session.bsrec --grey-first -o bench.json
+
+No camera, serial port or display is needed.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from modules import BW_KEY, ROI_HEIGHT_KEY, ROI_WIDTH_KEY
+from modules.app import ScannerApp
+from modules.recording import Recording
+
+IMAGE_PATTERNS = ("*.png", "*.jpg", "*.jpeg", "*.bmp")
+DRAW_METHODS = ("_draw_centers", "_draw_roi", "_draw_machine_status")
+
+
+def image_paths(directory: str) -> list:
+    return sorted(
+        path
+        for pattern in IMAGE_PATTERNS
+        for path in glob.glob(os.path.join(directory, pattern))
+    )
+
+
+def load_frames(source: str, limit: int) -> list:
+    if os.path.isdir(source):
+        paths = image_paths(source)
+        frames = [cv2.imread(path, cv2.IMREAD_COLOR) for path in paths]
+        frames = [frame for frame in frames if frame is not None][:limit]
+    else:
+        frames = list(Recording(source).frames[:limit])
+    if not frames:
+        raise SystemExit(f"no frames in {source}")
+    return frames
+
+
+def headless_app(source: str, **kwargs) -> ScannerApp:
+    # the camera only has to start, frames are fed to _process directly
+    if os.path.isdir(source):
+        kwargs["still_image"] = image_paths(source)[0]
+    else:
+        kwargs["replay"] = source
+    return ScannerApp(machine_port=None, headless=True, **kwargs)
+
+
+def parse_sizes(value: str) -> list:
+    if not value:
+        return [None]
+    return [tuple(int(v) for v in size.split("x")) for size in value.split(",")]
+
+
+class StageTimer:
+    """Wraps app methods on the instance so _process runs unchanged"""
+
+    def __init__(self, app: ScannerApp):
+        self.samples = {"filters": [], "detect": [], "draw": [], "total": []}
+        self._draw = 0.0
+        self._wrap(app, "_apply_filters", "filters")
+        self._wrap(app, "_detect_holes", "detect")
+        for name in DRAW_METHODS:
+            self._wrap(app, name, None)
+
+    def _wrap(self, app, name, stage):
+        method = getattr(app, name)
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                if stage is None:
+                    self._draw += elapsed
+                else:
+                    self.samples[stage].append(elapsed)
+
+        setattr(app, name, timed)
+
+    def frame_done(self, total: float):
+        self.samples["draw"].append(self._draw)
+        self.samples["total"].append(total)
+        self._draw = 0.0
+
+    def summary(self) -> dict:
+        result = {}
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            ms = np.array(samples) * 1e3
+            result[stage] = {
+                "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                "p99_ms": round(float(np.percentile(ms, 99)), 3),
+                "mean_ms": round(float(ms.mean()), 3),
+            }
+        return result
+
+
+def measure_allocations(app: ScannerApp, frames: list) -> dict:
+    """Bytes allocated and still held per frame, traced separately from timing"""
+    tracemalloc.start()
+    peaks, held = [], []
+    try:
+        for frame in frames:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            app._process(frame)
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            held.append(current - before)
+    finally:
+        tracemalloc.stop()
+    return {
+        "peak_bytes_p50": int(np.percentile(peaks, 50)),
+        "peak_bytes_max": int(max(peaks)),
+        "retained_bytes_mean": int(np.mean(held)),
+    }
+
+
+def run_case(app: ScannerApp, frames: list, roi: int, repeat: int, warmup: int):
+    app.SESSION_SETTINGS[ROI_WIDTH_KEY] = roi
+    app.SESSION_SETTINGS[ROI_HEIGHT_KEY] = roi
+    app._search_window = None
+    for frame in frames[:warmup]:
+        app._process(frame)
+    timer = StageTimer(app)
+    detections = 0
+    for _ in range(repeat):
+        for frame in frames:
+            started = time.perf_counter()
+            _, centers = app._process(frame)
+            timer.frame_done(time.perf_counter() - started)
+            detections += len(centers)
+    # drop the instance wrappers again
+    for name in ("_apply_filters", "_detect_holes") + DRAW_METHODS:
+        vars(app).pop(name, None)
+    result = timer.summary()
+    total = sum(timer.samples["total"])
+    result["fps"] = round(len(timer.samples["total"]) / total, 1) if total else None
+    result["frames"] = len(timer.samples["total"])
+    result["detections_per_frame"] = round(detections / result["frames"], 2)
+    result["allocations"] = measure_allocations(app, frames[: max(1, warmup)])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("source", help="image directory or frame recording")
+    parser.add_argument("--sizes", default="", help="WxH list, default as recorded")
+    parser.add_argument("--roi", default="100,300", help="search window sizes")
+    parser.add_argument("--limit", type=int, default=50, help="frames to load")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--grey-first", action="store_true")
+    parser.add_argument("--settings", help="session settings json to use")
+    parser.add_argument("-o", "--output", help="write JSON here, default stdout")
+    args = parser.parse_args(argv)
+
+    # stdout is kept for the report, the app and camera log to stderr
+    report_out, sys.stdout = sys.stdout, sys.stderr
+    frames = load_frames(args.source, args.limit)
+    app = headless_app(
+        args.source,
+        window_name="bench_vision",
+        use_default_session_settings=args.settings is None,
+        grey_first=args.grey_first,
+    )
+    if args.settings:
+        with open(args.settings) as f:
+            app.SESSION_SETTINGS.update(json.load(f))
+    app.SESSION_SETTINGS[BW_KEY] = 1
+
+    report = {
+        "source": args.source,
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "grey_first": args.grey_first,
+        "cases": [],
+    }
+    for size in parse_sizes(args.sizes):
+        scaled = frames
+        if size is not None:
+            scaled = [
+                cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                for frame in frames
+            ]
+        height, width = scaled[0].shape[:2]
+        for roi in (int(v) for v in args.roi.split(",")):
+            roi = min(roi, width - 1, height - 1)
+            case = {"size": f"{width}x{height}", "roi": roi}
+            case.update(run_case(app, scaled, roi, args.repeat, args.warmup))
+            report["cases"].append(case)
+    app._stop()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text, file=report_out)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,25 +1,38 @@
+import json
 import sys
 import glob
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import serial
+from serial.tools import list_ports
+from serial.tools.list_ports_common import ListPortInfo
+
+BAUD_RATE = 115200
+PROBE_TIMEOUT = 2.5
+CACHE_PATH = 'board_scanner_port.json'
+# USB serial bridges found on GRBL boards: Arduino, CH340, FTDI, CP210x,
+# Prolific
+GRBL_VIDS = {0x2341, 0x2A03, 0x1A86, 0x0403, 0x10C4, 0x067B}
 
 
 def serial_ports():
     """ Lists serial port names
 
-        :raises EnvironmentError:
-            On unsupported or unknown platforms
         :returns:
-            A list of the serial ports available on the system
+            A list of the serial ports pyserial's list_ports finds, possibly
+            empty; on Linux, Cygwin and macOS the ports that can be opened
+            from /dev when list_ports finds none
     """
-    if sys.platform.startswith('win'):
-        ports = ['COM%s' % (i + 1) for i in range(256)]
-    elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-        # this excludes your current terminal "/dev/tty"
-        ports = glob.glob('/dev/tty[A-Za-z]*')
-    elif sys.platform.startswith('darwin'):
+    ports = [port.device for port in list_ports.comports()]
+    if ports or not sys.platform.startswith(('linux', 'cygwin', 'darwin')):
+        return ports
+    # pyserial found nothing, e.g. without sysfs: fall back to opening nodes
+    if sys.platform.startswith('darwin'):
         ports = glob.glob('/dev/tty.*')
     else:
-        raise EnvironmentError('Unsupported platform')
+        # this excludes your current terminal "/dev/tty"
+        ports = glob.glob('/dev/tty[A-Za-z]*')
 
     result = []
     for port in ports:
@@ -30,3 +43,122 @@ def serial_ports():
         except (OSError, serial.SerialException):
             pass
     return result
+
+
+def candidate_ports():
+    """
+    USB serial ports from the OS port list (sysfs, registry, IOKit) without
+    opening any of them, known GRBL bridge chips first
+    """
+    ports = [port for port in list_ports.comports() if port.vid is not None]
+    return sorted(ports, key=lambda port: port.vid not in GRBL_VIDS)
+
+
+def probe_grbl(port, timeout=PROBE_TIMEOUT):
+    """
+    Returns the GRBL banner ('Grbl 1.1h ...') if port answers like GRBL
+    within timeout, None otherwise. Opening the port resets most Arduino
+    based boards; ctrl-x soft-resets the ones that don't.
+    """
+    try:
+        conn = serial.Serial(port, BAUD_RATE, timeout=0.1)
+    except (OSError, serial.SerialException):
+        return None
+    try:
+        conn.write(b'\x18')
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            line = conn.readline().strip().decode('ascii', 'replace')
+            if line.startswith('Grbl '):
+                return line
+    except (OSError, serial.SerialException):
+        return None
+    finally:
+        conn.close()
+    return None
+
+
+def _load_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(path, port):
+    cache = _load_cache(path)
+    cache['last'] = port.device
+    if port.serial_number:
+        cache.setdefault('serial_numbers', {})[port.serial_number] = port.device
+    with open(path, 'w') as f:
+        json.dump(cache, f, indent=2)
+
+
+def _probe_all(ports, timeout):
+    """
+    Probes ports in parallel, (port, banner) of the first one printing a
+    GRBL banner or None
+    """
+    pool = ThreadPoolExecutor(max_workers=len(ports))
+    probes = {pool.submit(probe_grbl, port.device, timeout): port for port in ports}
+    try:
+        for probe in as_completed(probes):
+            banner = probe.result()
+            if banner:
+                return probes[probe], banner
+    finally:
+        # don't wait for the slower probes once one answered
+        pool.shutdown(wait=False)
+    return None
+
+
+def find_grbl(
+    ports=None, timeout=PROBE_TIMEOUT, cache_path=CACHE_PATH, probe_unknown=False
+):
+    """
+    Port of the connected GRBL controller, or None.
+
+    A port whose USB serial number worked before is tried first, whatever
+    its device name is now, and returned if it still prints a GRBL banner.
+    Otherwise the known GRBL bridge chips are probed in parallel. Ports with
+    other (or no) vendor ids are only probed with probe_unknown, the probe
+    resets whatever device is on them.
+    """
+    if ports is None:
+        ports = candidate_ports()
+    ports = [
+        port if hasattr(port, 'device') else ListPortInfo(port, True)
+        for port in ports
+    ]
+    if cache_path:
+        known = _load_cache(cache_path).get('serial_numbers', {})
+        cached = [
+            port for port in ports
+            if port.serial_number and port.serial_number in known
+        ]
+        found = _probe_all(cached, timeout) if cached else None
+        if found:
+            port, banner = found
+            print('GRBL cached', port.device, banner)
+            return port.device
+        ports = [port for port in ports if port not in cached]
+
+    groups = [[port for port in ports if port.vid in GRBL_VIDS]]
+    if probe_unknown:
+        groups.append([port for port in ports if port.vid not in GRBL_VIDS])
+    for group in groups:
+        found = _probe_all(group, timeout) if group else None
+        if found:
+            port, banner = found
+            print('GRBL found', port.device, banner)
+            if cache_path:
+                _save_cache(cache_path, port)
+            return port.device
+    return None
+
+
+if __name__ == '__main__':
+    for port in candidate_ports():
+        print(port.device, port.description, port.serial_number)
+    print(find_grbl(probe_unknown='--all' in sys.argv))